@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Benchmark: old pool-expansion winner draw vs. weighted_sample() from bot.py
+# Usage: python bench_giveaway.py [entries] [winners]
+import random
+import sys
+import time
+
+from bot import weighted_sample
+
+def old_pool_expansion(participants, weights, winners_count):
+    """The previous end_giveaway_logic / reroll_giveaway algorithm."""
+    weighted_pool = []
+    for uid, chance in zip(participants, weights):
+        weighted_pool.extend([uid] * chance)
+
+    winners = []
+    temp_pool = weighted_pool.copy()
+    for _ in range(winners_count):
+        if not temp_pool: break
+        winner = random.choice(temp_pool)
+        winners.append(winner)
+        temp_pool = [x for x in temp_pool if x != winner]
+    return winners
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def run(name, participants, weights, winners_count):
+    old = timed(old_pool_expansion, participants, weights, winners_count)
+    new = timed(weighted_sample, participants, weights, winners_count)
+    print(f"{name:<38} pool={sum(weights):>12,}  old={old * 1000:>9.1f} ms  new={new * 1000:>8.1f} ms  x{old / new:,.0f}")
+
+if __name__ == "__main__":
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    winners_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    participants = [str(100000000000000000 + i) for i in range(entries)]
+
+    print("=" * 90)
+    print(f"  Winner draw benchmark - {entries:,} entries, {winners_count} winners")
+    print("=" * 90)
+
+    run("No bonus (weight 1)", participants, [1] * entries, winners_count)
+
+    rng = random.Random(1)
+    run("10% of users with 1-20 bonus", participants, [1 + (rng.randint(1, 20) if rng.random() < 0.1 else 0) for _ in participants], winners_count)
+
+    weights = [1] * entries
+    weights[0] = 10001 # Admin did /gchance 10000 on one user
+    run("One user with /gchance 10000", participants, weights, winners_count)
+
+    for i in range(100):
+        weights[i] = 10001
+    run("100 users with /gchance 10000", participants, weights, winners_count)
+
+    # Sanity check: a user with 3x the weight should win ~3x as often
+    small = ["a", "b", "c"]
+    wins = {uid: 0 for uid in small}
+    for _ in range(30000):
+        wins[weighted_sample(small, [3, 1, 1], 1)[0]] += 1
+    print(f"Distribution check (weights 3/1/1, 30k draws): {wins}")
@@ -6,8 +6,28 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
 import json
 import random
+import tempfile
+import atexit
+import sqlite3
+import heapq
+import math
+import bisect
+import itertools
+import time
+import csv
+import gzip
+import threading
+import html
+import re
+import aiohttp
+from collections import deque
 from typing import Literal
 
+try:
+    import numpy as np # Optional: only used to speed up winner draws on huge giveaways
+except ImportError:
+    np = None
+
 # Load environment variables
 load_dotenv()
 
@@ -16,7 +36,70 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+BULK_ROUTE_MAX_PAUSE = 5.0 # An exhausted bucket resetting later than this is per-channel, not a reason to pause a whole job
+
+def rest_route(method, url):
+    """Key rate limits are tracked under: DELETE /channels/123... -> DELETE /channels/{id}"""
+    path = re.sub(r"^/api/v\d+", "", url.path)
+    path = re.sub(r"/\d{15,25}(?=/|$)", "/{id}", path)
+    return f"{method} {path}"
+
+class RateLimitMonitor:
+    """Reads Discord's rate-limit headers off every REST response (aiohttp trace hook).
+
+    Bulk jobs ask it how long to hold their next request and how many 429s their routes got,
+    instead of sleeping a fixed delay between calls.
+    """
+    def __init__(self):
+        self.blocked_until = {} # route (or "global") -> time.monotonic() when requests may resume
+        self.hits = {} # route -> 429 responses seen
+
+    def trace_config(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(self._on_request_end)
+        return trace
+
+    async def _on_request_end(self, session, context, params):
+        response = params.response
+        headers = response.headers
+        route = rest_route(params.method, params.url)
+        if response.status == 429:
+            self.hits[route] = self.hits.get(route, 0) + 1
+            retry_after = float(headers.get("Retry-After") or 1)
+            scope = "global" if headers.get("X-RateLimit-Global") == "true" or headers.get("X-RateLimit-Scope") == "global" else route
+            self._block(scope, retry_after)
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            reset_after = float(headers.get("X-RateLimit-Reset-After") or 0)
+            if reset_after <= BULK_ROUTE_MAX_PAUSE:
+                self._block(route, reset_after)
+
+    def _block(self, key, seconds):
+        self.blocked_until[key] = max(self.blocked_until.get(key, 0), time.monotonic() + seconds)
+
+    def hits_for(self, routes):
+        return sum(self.hits.get(route, 0) for route in routes)
+
+    async def wait(self, routes):
+        while True:
+            delay = max((self.blocked_until.get(key, 0) for key in ("global", *routes)), default=0) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+rate_limits = RateLimitMonitor()
+
+class KarysBot(commands.Bot):
+    async def close(self):
+        # Flush any pending (debounced) data writes before disconnecting
+        try:
+            await data_saver.flush()
+            print(f"[DATA] {data_saver.summary()}")
+        except Exception as e:
+            print(f"[ERROR] Final data flush failed: {e}")
+        await super().close()
+
+bot = KarysBot(command_prefix='!', intents=intents, http_trace=rate_limits.trace_config())
 import uuid
 INSTANCE_ID = str(uuid.uuid4())[:8]
 
@@ -53,24 +136,1190 @@ def load_data(filename):
     except (FileNotFoundError, json.JSONDecodeError):
         return {}
 
+class ParticipantSet:
+    """Insertion-ordered set of user IDs: O(1) membership checks, stable join order for display."""
+    __slots__ = ("_order", "_index")
+
+    def __init__(self, user_ids=()):
+        self._order = []
+        self._index = {} # user_id -> position in _order
+        for user_id in user_ids:
+            self.add(user_id)
+
+    def add(self, user_id):
+        """Add a user, returns False if they were already in."""
+        user_id = str(user_id)
+        if user_id in self._index:
+            return False
+        self._index[user_id] = len(self._order)
+        self._order.append(user_id)
+        return True
+
+    def page(self, start, stop):
+        return self._order[start:stop]
+
+    def to_list(self):
+        return list(self._order)
+
+    def __contains__(self, user_id):
+        return str(user_id) in self._index
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __getitem__(self, index):
+        return self._order[index]
+
+    def __repr__(self):
+        return f"ParticipantSet({len(self._order)} users)"
+
+class WindowedCounter:
+    """Per-day buckets in a ring buffer, plus running sums for fixed windows (O(1) window reads)."""
+    RING_DAYS = 30
+    WINDOWS = (1, 7, 30)
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.day = state.get("day", current_day())
+        self.buckets = list(state.get("buckets", [0] * self.RING_DAYS))
+        self.sums = {}
+        # Window w covers days (day - w, day]
+        for window in self.WINDOWS:
+            self.sums[window] = sum(self.buckets[(self.day - offset) % self.RING_DAYS] for offset in range(window))
+
+    def _advance(self, today):
+        if today <= self.day:
+            return
+        if today - self.day >= self.RING_DAYS:
+            # Everything expired
+            self.buckets = [0] * self.RING_DAYS
+            self.sums = {window: 0 for window in self.WINDOWS}
+            self.day = today
+            return
+        while self.day < today:
+            self.day += 1
+            for window in self.WINDOWS:
+                # Day (new day - window) just left this window
+                self.sums[window] -= self.buckets[(self.day - window) % self.RING_DAYS]
+            self.buckets[self.day % self.RING_DAYS] = 0
+
+    def add(self, amount, today=None):
+        self._advance(today or current_day())
+        self.buckets[self.day % self.RING_DAYS] += amount
+        for window in self.WINDOWS:
+            self.sums[window] += amount
+
+    def total(self, window, today=None):
+        self._advance(today or current_day())
+        return self.sums[window]
+
+    def to_dict(self):
+        return {"day": self.day, "buckets": self.buckets}
+
+def current_day():
+    # UTC day number
+    return int(time.time() // 86400)
+
+def json_default(obj):
+    # Custom containers are written to disk as plain lists / dicts
+    if isinstance(obj, ParticipantSet):
+        return obj.to_list()
+    if isinstance(obj, WindowedCounter):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def serialize_json(data):
+    return json.dumps(data, indent=4, default=json_default)
+
+def write_json_atomic(filename, data):
+    """Serialize data and replace filename atomically (temp file + rename)."""
+    write_text_atomic(filename, serialize_json(data))
+
+def write_text_atomic(filename, payload):
+    """Replace filename with payload atomically (temp file + rename). Safe to run in a thread."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(filename)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+# Seconds to wait before writing a dirty file, so bursts of changes become one write
+SAVE_DEBOUNCE_SECONDS = 2.0
+
+class WriteBehindSaver:
+    """Marks files dirty and writes each one at most once per debounce window, off the event loop."""
+    def __init__(self, delay=SAVE_DEBOUNCE_SECONDS):
+        self.delay = delay
+        self.dirty = {} # filename -> data object to write
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+        self.requested = 0
+        self.written = 0
+
+    def mark_dirty(self, filename, data):
+        self.requested += 1
+        self.dirty[filename] = data
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts / interpreter shutdown) - write straight away
+            self.flush_sync()
+            return
+
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Keep going while new changes arrive during a flush
+        while self.dirty:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            pending, self.dirty = self.dirty, {}
+            for filename, data in pending.items():
+                try:
+                    # Serialized here on the event loop, so the snapshot is consistent (nothing
+                    # mutates the data meanwhile); only the disk write runs in the thread
+                    payload = serialize_json(data)
+                    await asyncio.to_thread(write_text_atomic, filename, payload)
+                    self.written += 1
+                except Exception as e:
+                    print(f"[ERROR] Failed to save {filename}: {e}")
+                    # Keep it dirty so the next flush retries
+                    self.dirty.setdefault(filename, data)
+
+    def flush_sync(self):
+        pending, self.dirty = self.dirty, {}
+        for filename, data in pending.items():
+            try:
+                write_json_atomic(filename, data)
+                self.written += 1
+            except Exception as e:
+                print(f"[ERROR] Failed to save {filename}: {e}")
+
+    def summary(self):
+        saved = max(self.requested - self.written, 0)
+        return f"Save requests: {self.requested} | Disk writes: {self.written} | Writes saved: {saved}"
+
+data_saver = WriteBehindSaver()
+# Last resort if the process exits without going through bot.close()
+atexit.register(data_saver.flush_sync)
+
 def save_data(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
+    # Writes are coalesced and done in the background, see WriteBehindSaver
+    data_saver.mark_dirty(filename, data)
+
+# --- SQLite Storage ---
+# Set DATA_BACKEND=sqlite in .env to store invites/giveaways in SQLite instead of JSON files
+DATA_BACKEND = os.getenv("DATA_BACKEND", "json").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bot_data.db")
+# JSON backend: one folder per guild (guild_data/<guild_id>/invites.json, giveaways.json, ...)
+GUILD_DATA_DIR = os.getenv("GUILD_DATA_DIR", "guild_data")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS invite_counters (
+    user_id TEXT PRIMARY KEY,
+    regular INTEGER NOT NULL DEFAULT 0,
+    fake INTEGER NOT NULL DEFAULT 0,
+    bonus INTEGER NOT NULL DEFAULT 0,
+    leaves INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS giveaways (
+    message_id TEXT PRIMARY KEY,
+    guild_id TEXT,
+    channel_id INTEGER NOT NULL,
+    prize TEXT NOT NULL,
+    winners INTEGER NOT NULL,
+    required_invites INTEGER NOT NULL DEFAULT 0,
+    end_time INTEGER NOT NULL,
+    ended INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_giveaways_guild ON giveaways(guild_id, ended, end_time);
+CREATE INDEX IF NOT EXISTS idx_giveaways_end_time ON giveaways(ended, end_time);
+CREATE TABLE IF NOT EXISTS giveaway_participants (
+    giveaway_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (giveaway_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_participants_user ON giveaway_participants(user_id);
+CREATE TABLE IF NOT EXISTS giveaway_winners (
+    giveaway_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (giveaway_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_winners_user ON giveaway_winners(user_id);
+CREATE TABLE IF NOT EXISTS member_inviters (
+    member_id TEXT PRIMARY KEY,
+    inviter_id TEXT NOT NULL,
+    fake INTEGER NOT NULL DEFAULT 0,
+    left_guild INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_member_inviters_inviter ON member_inviters(inviter_id);
+CREATE TABLE IF NOT EXISTS guild_invite_counters (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    regular INTEGER NOT NULL DEFAULT 0,
+    fake INTEGER NOT NULL DEFAULT 0,
+    bonus INTEGER NOT NULL DEFAULT 0,
+    leaves INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS guild_member_inviters (
+    guild_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    inviter_id TEXT NOT NULL,
+    fake INTEGER NOT NULL DEFAULT 0,
+    left_guild INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, member_id)
+);
+CREATE TABLE IF NOT EXISTS guild_invite_windows (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+"""
+
+# Giveaway keys that have their own column, everything else goes to the "extra" JSON column
+GIVEAWAY_COLUMNS = ("guild_id", "channel_id", "prize", "winners", "required_invites", "end_time", "ended")
+
+class SQLiteStore:
+    """Row-level storage for invite counters and giveaways (one row per change instead of a full file rewrite)."""
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None) # Autocommit, each statement is its own transaction
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Invites (partitioned by guild, the unprefixed tables only hold pre-partitioning data)
+    def load_invites(self, guild_id):
+        rows = self.conn.execute(
+            "SELECT user_id, regular, fake, bonus, leaves FROM guild_invite_counters WHERE guild_id = ?",
+            (str(guild_id),)
+        )
+        return {row["user_id"]: {"regular": row["regular"], "fake": row["fake"], "bonus": row["bonus"], "leaves": row["leaves"]} for row in rows}
+
+    def save_invite_counters(self, guild_id, user_id, data):
+        self.conn.execute(
+            "INSERT INTO guild_invite_counters (guild_id, user_id, regular, fake, bonus, leaves) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET regular=excluded.regular, fake=excluded.fake, bonus=excluded.bonus, leaves=excluded.leaves",
+            (str(guild_id), str(user_id), data.get("regular", 0), data.get("fake", 0), data.get("bonus", 0), data.get("leaves", 0))
+        )
+
+    def load_member_inviters(self, guild_id):
+        rows = self.conn.execute(
+            "SELECT member_id, inviter_id, fake, left_guild FROM guild_member_inviters WHERE guild_id = ?",
+            (str(guild_id),)
+        )
+        return {row["member_id"]: {"inviter_id": row["inviter_id"], "fake": bool(row["fake"]), "left": bool(row["left_guild"])} for row in rows}
+
+    def save_member_inviter(self, guild_id, member_id, record):
+        self.conn.execute(
+            "INSERT INTO guild_member_inviters (guild_id, member_id, inviter_id, fake, left_guild) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(guild_id, member_id) DO UPDATE SET inviter_id=excluded.inviter_id, fake=excluded.fake, left_guild=excluded.left_guild",
+            (str(guild_id), str(member_id), str(record["inviter_id"]), 1 if record["fake"] else 0, 1 if record["left"] else 0)
+        )
+
+    def load_invite_windows(self, guild_id):
+        rows = self.conn.execute("SELECT user_id, state FROM guild_invite_windows WHERE guild_id = ?", (str(guild_id),))
+        return {row["user_id"]: json.loads(row["state"]) for row in rows}
+
+    def save_invite_window(self, guild_id, user_id, state):
+        self.conn.execute(
+            "INSERT INTO guild_invite_windows (guild_id, user_id, state) VALUES (?, ?, ?) "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET state=excluded.state",
+            (str(guild_id), str(user_id), json.dumps(state))
+        )
+
+    # Giveaways
+    def _giveaway_row(self, message_id, data):
+        extra = {k: v for k, v in data.items() if k not in GIVEAWAY_COLUMNS and k not in ("participants", "winners_list")}
+        guild_id = data.get("guild_id")
+        return (
+            str(message_id),
+            str(guild_id) if guild_id else None,
+            int(data["channel_id"]),
+            data["prize"],
+            int(data["winners"]),
+            int(data.get("required_invites", 0)),
+            int(data["end_time"]),
+            1 if data.get("ended") else 0,
+            json.dumps(extra)
+        )
+
+    def save_giveaway(self, message_id, data):
+        self.conn.execute(
+            "INSERT INTO giveaways (message_id, guild_id, channel_id, prize, winners, required_invites, end_time, ended, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(message_id) DO UPDATE SET guild_id=excluded.guild_id, channel_id=excluded.channel_id, prize=excluded.prize, "
+            "winners=excluded.winners, required_invites=excluded.required_invites, end_time=excluded.end_time, ended=excluded.ended, extra=excluded.extra",
+            self._giveaway_row(message_id, data)
+        )
 
-# Load data on startup
-invites_data = load_data('invites.json') # Structure: {"user_id": {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}}
-giveaways_data = load_data('giveaways.json')
-invite_cache = {} # Cache for tracking invite uses
+    def add_participant(self, giveaway_id, user_id):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO giveaway_participants (giveaway_id, user_id) VALUES (?, ?)",
+            (str(giveaway_id), str(user_id))
+        )
+
+    def set_winners(self, giveaway_id, winners):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM giveaway_winners WHERE giveaway_id = ?", (str(giveaway_id),))
+            self.conn.executemany(
+                "INSERT INTO giveaway_winners (giveaway_id, position, user_id) VALUES (?, ?, ?)",
+                [(str(giveaway_id), i, str(uid)) for i, uid in enumerate(winners)]
+            )
+
+    def _giveaway_dict(self, row):
+        data = json.loads(row["extra"] or "{}")
+        data.update({
+            "channel_id": row["channel_id"],
+            "prize": row["prize"],
+            "winners": row["winners"],
+            "required_invites": row["required_invites"],
+            "end_time": row["end_time"],
+            "ended": bool(row["ended"])
+        })
+        if row["guild_id"]:
+            data["guild_id"] = int(row["guild_id"])
+        return data
+
+    def load_giveaways(self, guild_id):
+        guild_id = str(guild_id)
+        giveaways = {}
+        for row in self.conn.execute("SELECT * FROM giveaways WHERE guild_id = ?", (guild_id,)):
+            data = self._giveaway_dict(row)
+            data["participants"] = ParticipantSet()
+            giveaways[row["message_id"]] = data
+
+        # rowid order = join order
+        rows = self.conn.execute(
+            "SELECT p.giveaway_id, p.user_id FROM giveaway_participants p "
+            "JOIN giveaways g ON g.message_id = p.giveaway_id WHERE g.guild_id = ? ORDER BY p.rowid",
+            (guild_id,)
+        )
+        for row in rows:
+            giveaways[row["giveaway_id"]]["participants"].add(row["user_id"])
+
+        rows = self.conn.execute(
+            "SELECT w.giveaway_id, w.user_id FROM giveaway_winners w "
+            "JOIN giveaways g ON g.message_id = w.giveaway_id WHERE g.guild_id = ? ORDER BY w.giveaway_id, w.position",
+            (guild_id,)
+        )
+        for row in rows:
+            giveaways[row["giveaway_id"]].setdefault("winners_list", []).append(row["user_id"])
+        return giveaways
+
+    def active_giveaways(self, guild_id=None):
+        """Active giveaways (soonest ending first), answered from the guild/end_time indexes."""
+        if guild_id is None:
+            rows = self.conn.execute("SELECT * FROM giveaways WHERE ended = 0 ORDER BY end_time")
+        else:
+            rows = self.conn.execute(
+                "SELECT * FROM giveaways WHERE ended = 0 AND guild_id = ? ORDER BY end_time",
+                (str(guild_id),)
+            )
+        return [(row["message_id"], self._giveaway_dict(row)) for row in rows]
+
+    # Pre-partitioning data (rows without a guild)
+    def has_legacy_data(self):
+        return any(
+            self.conn.execute(query).fetchone()
+            for query in (
+                "SELECT 1 FROM invite_counters LIMIT 1",
+                "SELECT 1 FROM member_inviters LIMIT 1",
+                "SELECT 1 FROM giveaways WHERE guild_id IS NULL LIMIT 1"
+            )
+        )
 
-def get_invites(user_id):
+    def legacy_giveaway_channels(self):
+        """message_id -> channel_id of the giveaways saved without a guild."""
+        rows = self.conn.execute("SELECT message_id, channel_id FROM giveaways WHERE guild_id IS NULL")
+        return {row["message_id"]: row["channel_id"] for row in rows}
+
+    def assign_legacy_data(self, default_guild_id, giveaway_guilds):
+        """Move guild-less rows into the guild partitions. giveaway_guilds: message_id -> guild_id."""
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE giveaways SET guild_id = ? WHERE message_id = ? AND guild_id IS NULL",
+                [(str(guild_id), str(message_id)) for message_id, guild_id in giveaway_guilds.items()]
+            )
+            if default_guild_id is not None:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO guild_invite_counters (guild_id, user_id, regular, fake, bonus, leaves) "
+                    "SELECT ?, user_id, regular, fake, bonus, leaves FROM invite_counters",
+                    (str(default_guild_id),)
+                )
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO guild_member_inviters (guild_id, member_id, inviter_id, fake, left_guild) "
+                    "SELECT ?, member_id, inviter_id, fake, left_guild FROM member_inviters",
+                    (str(default_guild_id),)
+                )
+                self.conn.execute("DELETE FROM invite_counters")
+                self.conn.execute("DELETE FROM member_inviters")
+
+    # Migration
+    def is_migrated(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        return row is not None
+
+    def migrate_from_json(self, invites_file='invites.json', giveaways_file='giveaways.json', members_file='member_inviters.json', guild_dir=None):
+        """One-shot import of the JSON files: the legacy global ones and the per-guild ones
+        under guild_dir. Returns (invite rows, giveaway rows) imported."""
+        if self.is_migrated():
+            return (0, 0)
+
+        guild_dir = guild_dir or GUILD_DATA_DIR
+        invites = load_data(invites_file)
+        giveaways = load_data(giveaways_file)
+        members = load_data(members_file)
+        invite_count, giveaway_count = len(invites), len(giveaways)
+        with self.conn:
+            self.conn.execute("BEGIN")
+            # Global files have no guild: kept in the unprefixed tables until assign_legacy_data()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO invite_counters (user_id, regular, fake, bonus, leaves) VALUES (?, ?, ?, ?, ?)",
+                [(str(uid), d.get("regular", 0), d.get("fake", 0), d.get("bonus", 0), d.get("leaves", 0)) for uid, d in invites.items()]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO member_inviters (member_id, inviter_id, fake, left_guild) VALUES (?, ?, ?, ?)",
+                [(str(mid), str(r["inviter_id"]), 1 if r["fake"] else 0, 1 if r["left"] else 0) for mid, r in members.items()]
+            )
+            self._import_giveaways(giveaways)
+
+            guild_ids = os.listdir(guild_dir) if os.path.isdir(guild_dir) else []
+            for guild_id in guild_ids:
+                if not guild_id.isdigit():
+                    continue
+                folder = os.path.join(guild_dir, guild_id)
+                guild_invites = load_data(os.path.join(folder, 'invites.json'))
+                for user_id, data in guild_invites.items():
+                    self.save_invite_counters(guild_id, user_id, data)
+                for member_id, record in load_data(os.path.join(folder, 'member_inviters.json')).items():
+                    self.save_member_inviter(guild_id, member_id, record)
+                guild_giveaways = load_data(os.path.join(folder, 'giveaways.json'))
+                for data in guild_giveaways.values():
+                    data["guild_id"] = int(guild_id)
+                self._import_giveaways(guild_giveaways)
+                invite_count += len(guild_invites)
+                giveaway_count += len(guild_giveaways)
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.now().isoformat(),)
+            )
+        return (invite_count, giveaway_count)
+
+    def _import_giveaways(self, giveaways):
+        for message_id, data in giveaways.items():
+            self.save_giveaway(message_id, data)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO giveaway_participants (giveaway_id, user_id) VALUES (?, ?)",
+                [(str(message_id), str(uid)) for uid in data.get("participants", [])]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO giveaway_winners (giveaway_id, position, user_id) VALUES (?, ?, ?)",
+                [(str(message_id), i, str(uid)) for i, uid in enumerate(data.get("winners_list", []))]
+            )
+
+storage = None
+if DATA_BACKEND == "sqlite":
+    storage = SQLiteStore(SQLITE_PATH)
+    migrated = storage.migrate_from_json()
+    if migrated != (0, 0):
+        print(f"[DATA] Migrated {migrated[0]} invite records and {migrated[1]} giveaways from JSON to {SQLITE_PATH}")
+
+# Invites, giveaways and the member -> inviter index are partitioned per guild and loaded
+# the first time a guild is touched, see GuildShard / get_shard() below
+
+def guild_data_path(guild_id, filename):
+    return os.path.join(GUILD_DATA_DIR, str(guild_id), filename)
+
+# guild_id -> {invite code: {"uses", "max_uses", "inviter_id"}}, filled per guild on first use
+# Persisted so joins right after a restart can still be diffed against the last known uses
+invite_cache = {}
+
+# --- Invite Leaderboard ---
+class _TreapNode:
+    __slots__ = ("key", "priority", "size", "left", "right")
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+
+def _size(node):
+    return node.size if node else 0
+
+def _update_size(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+class InviteLeaderboard:
+    """Order-statistics treap keyed by (-total invites, user_id).
+
+    Updates, "your rank" and k-th place lookups are O(log n) (expected); top-N is O(N log n).
+    Only users with at least one valid invite are ranked.
+    """
+    def __init__(self):
+        self.root = None
+        self.scores = {} # user_id -> total currently stored in the tree
+
+    def __len__(self):
+        return _size(self.root)
+
+    def _split(self, node, key):
+        """(keys < key, keys >= key)"""
+        if node is None:
+            return None, None
+        if node.key < key:
+            left, right = self._split(node.right, key)
+            node.right = left
+            _update_size(node)
+            return node, right
+        left, right = self._split(node.left, key)
+        node.left = right
+        _update_size(node)
+        return left, node
+
+    def _merge(self, left, right):
+        if left is None or right is None:
+            return left or right
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            _update_size(left)
+            return left
+        right.left = self._merge(left, right.left)
+        _update_size(right)
+        return right
+
+    def _delete(self, node, key):
+        if node is None:
+            return None
+        if node.key == key:
+            return self._merge(node.left, node.right)
+        if key < node.key:
+            node.left = self._delete(node.left, key)
+        else:
+            node.right = self._delete(node.right, key)
+        _update_size(node)
+        return node
+
+    def build(self, totals):
+        """Bulk load {user_id: total} in O(n log n) (sort) instead of n separate inserts."""
+        self.scores = {str(uid): total for uid, total in totals.items() if total > 0}
+        keys = sorted((-total, uid) for uid, total in self.scores.items())
+
+        def build_range(lo, hi):
+            if lo >= hi:
+                return None
+            mid = (lo + hi) // 2
+            node = _TreapNode(keys[mid])
+            node.left = build_range(lo, mid)
+            node.right = build_range(mid + 1, hi)
+            _update_size(node)
+            return node
+
+        self.root = build_range(0, len(keys))
+
+        # Hand out random priorities level by level, highest first, so the heap order holds
+        priorities = sorted((random.random() for _ in keys), reverse=True)
+        level = [self.root] if self.root else []
+        i = 0
+        while level:
+            next_level = []
+            for node in level:
+                node.priority = priorities[i]
+                i += 1
+                next_level.extend(child for child in (node.left, node.right) if child)
+            level = next_level
+
+    def update(self, user_id, total):
+        user_id = str(user_id)
+        old = self.scores.get(user_id)
+        if old == total:
+            return
+        if old is not None:
+            self.root = self._delete(self.root, (-old, user_id))
+            del self.scores[user_id]
+        if total > 0:
+            key = (-total, user_id)
+            left, right = self._split(self.root, key)
+            self.root = self._merge(self._merge(left, _TreapNode(key)), right)
+            self.scores[user_id] = total
+
+    def rank(self, user_id):
+        """1-based rank, or None if the user isn't ranked."""
+        user_id = str(user_id)
+        if user_id not in self.scores:
+            return None
+        key = (-self.scores[user_id], user_id)
+        node, smaller = self.root, 0
+        while node:
+            if key < node.key:
+                node = node.left
+            elif key > node.key:
+                smaller += _size(node.left) + 1
+                node = node.right
+            else:
+                return smaller + _size(node.left) + 1
+        return None
+
+    def kth(self, index):
+        """(user_id, total) at 0-based position index."""
+        node = self.root
+        while node:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node.key[1], -node.key[0]
+            else:
+                index -= left_size + 1
+                node = node.right
+        return None
+
+    def top(self, count, offset=0):
+        return [self.kth(i) for i in range(offset, min(offset + count, len(self)))]
+
+# --- Per-Guild Data ---
+class GuildShard:
+    """One guild's invite counters, giveaways, member -> inviter index and leaderboard.
+
+    Loaded on first access (get_shard), so memory and save cost follow the guilds that are
+    actually active. With JSON every guild has its own folder, so a save only rewrites that
+    guild's file.
+    """
+    def __init__(self, guild_id):
+        self.guild_id = int(guild_id)
+        if storage:
+            self.invites = storage.load_invites(self.guild_id)
+            self.giveaways = storage.load_giveaways(self.guild_id)
+            self.member_inviters = storage.load_member_inviters(self.guild_id)
+            windows = storage.load_invite_windows(self.guild_id)
+            legacy_windows = self.path('invite_windows.json')
+            if os.path.exists(legacy_windows):
+                # Windows were kept in JSON with both backends before they had a table
+                for user_id, state in load_data(legacy_windows).items():
+                    if user_id not in windows:
+                        windows[user_id] = state
+                        storage.save_invite_window(self.guild_id, user_id, state)
+                os.replace(legacy_windows, f"{legacy_windows}.migrated")
+        else:
+            os.makedirs(os.path.join(GUILD_DATA_DIR, str(self.guild_id)), exist_ok=True)
+            self.invites = load_data(self.path('invites.json')) # Structure: {"user_id": {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}}
+            self.giveaways = load_data(self.path('giveaways.json'))
+            for giveaway in self.giveaways.values():
+                # Stored as a list on disk
+                giveaway["participants"] = ParticipantSet(giveaway.get("participants", []))
+            # Which inviter each tracked member joined through: {"member_id": {"inviter_id": "...", "fake": bool, "left": bool}}
+            self.member_inviters = load_data(self.path('member_inviters.json'))
+            windows = load_data(self.path('invite_windows.json'))
+        # Net valid invites per day (regular joins minus leaves) for the last 30 days, per inviter
+        self.invite_windows = {user_id: WindowedCounter(state) for user_id, state in windows.items()}
+        self.leaderboard = InviteLeaderboard()
+        self.leaderboard.build({user_id: get_invites(self.guild_id, user_id, shard=self) for user_id in list(self.invites)})
+
+    def path(self, filename):
+        return guild_data_path(self.guild_id, filename)
+
+    # Persist helpers: single-row writes with SQLite, debounced full-file writes with JSON
+    def persist_invites(self, user_id):
+        user_id = str(user_id)
+        if storage:
+            storage.save_invite_counters(self.guild_id, user_id, self.invites[user_id])
+        else:
+            save_data(self.path('invites.json'), self.invites)
+
+    def persist_giveaway(self, giveaway_id):
+        giveaway_id = str(giveaway_id)
+        if storage:
+            data = self.giveaways[giveaway_id]
+            storage.save_giveaway(giveaway_id, data)
+            if "winners_list" in data:
+                storage.set_winners(giveaway_id, data["winners_list"])
+        else:
+            save_data(self.path('giveaways.json'), self.giveaways)
+
+    def persist_participant(self, giveaway_id, user_id):
+        if storage:
+            storage.add_participant(giveaway_id, user_id)
+        else:
+            save_data(self.path('giveaways.json'), self.giveaways)
+
+    def persist_member_inviter(self, member_id):
+        member_id = str(member_id)
+        if storage:
+            storage.save_member_inviter(self.guild_id, member_id, self.member_inviters[member_id])
+        else:
+            save_data(self.path('member_inviters.json'), self.member_inviters)
+
+    def persist_invite_window(self, user_id):
+        user_id = str(user_id)
+        if storage:
+            storage.save_invite_window(self.guild_id, user_id, self.invite_windows[user_id].to_dict())
+        else:
+            save_data(self.path('invite_windows.json'), self.invite_windows)
+
+guild_shards = {} # guild_id -> GuildShard, only guilds touched since startup
+
+def get_shard(guild_id):
+    guild_id = int(guild_id)
+    shard = guild_shards.get(guild_id)
+    if shard is None:
+        shard = guild_shards[guild_id] = GuildShard(guild_id)
+    return shard
+
+def bump_invite_counter(guild_id, user_id, field, amount=1):
+    """Single entry point for changing an invite counter (regular / fake / bonus / leaves)."""
+    shard = get_shard(guild_id)
     user_id = str(user_id)
-    if user_id not in invites_data:
-        invites_data[user_id] = {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}
+    if user_id not in shard.invites:
+        shard.invites[user_id] = {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}
+    shard.invites[user_id][field] += amount
+    if field == "leaves" and shard.invites[user_id][field] < 0:
+        shard.invites[user_id][field] = 0
+    shard.persist_invites(user_id)
+    shard.leaderboard.update(user_id, get_invites(guild_id, user_id))
+    # Bonus and fake don't count towards recent invites
+    if field == "regular":
+        record_windowed_invite(guild_id, user_id, amount)
+    elif field == "leaves":
+        record_windowed_invite(guild_id, user_id, -amount)
+    return shard.invites[user_id][field]
+
+def get_invites(guild_id, user_id, shard=None):
+    shard = shard or get_shard(guild_id)
+    user_id = str(user_id)
+    if user_id not in shard.invites:
+        shard.invites[user_id] = {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}
     
-    data = invites_data[user_id]
+    data = shard.invites[user_id]
     total = (data["regular"] + data["bonus"]) - (data["leaves"] + data["fake"])
     return total if total > 0 else 0
 
+# --- Time-Windowed Invites ---
+def record_windowed_invite(guild_id, user_id, amount):
+    shard = get_shard(guild_id)
+    user_id = str(user_id)
+    counter = shard.invite_windows.get(user_id)
+    if counter is None:
+        counter = shard.invite_windows[user_id] = WindowedCounter()
+    counter.add(amount)
+    shard.persist_invite_window(user_id)
+
+def get_windowed_invites(guild_id, user_id, days):
+    """Valid invites from the last `days` days (one of WindowedCounter.WINDOWS)."""
+    counter = get_shard(guild_id).invite_windows.get(str(user_id))
+    total = counter.total(days) if counter else 0
+    return total if total > 0 else 0
+
+# --- Pre-Partitioning Data ---
+# Invite counters saved before per-guild partitioning don't say which guild they belong to.
+# With a single guild they go to that guild, otherwise set LEGACY_GUILD_ID in .env.
+LEGACY_GUILD_ID = os.getenv("LEGACY_GUILD_ID")
+
+def legacy_default_guild():
+    if LEGACY_GUILD_ID:
+        return int(LEGACY_GUILD_ID)
+    if len(bot.guilds) == 1:
+        return bot.guilds[0].id
+    return None
+
+def legacy_giveaway_guild(data):
+    if data.get("guild_id"):
+        return int(data["guild_id"])
+    channel = bot.get_channel(data["channel_id"])
+    if channel is not None and getattr(channel, "guild", None):
+        return channel.guild.id
+    return legacy_default_guild()
+
+def retire_legacy_file(filename, leftover=None):
+    """Keep what couldn't be assigned, otherwise move the file out of the way."""
+    if not load_data(filename):
+        # Missing or empty, nothing was migrated from it
+        return
+    if leftover:
+        write_json_atomic(filename, leftover)
+    elif os.path.exists(filename):
+        os.replace(filename, f"{filename}.migrated")
+
+def stored_active_giveaways():
+    """(message_id, data) of every giveaway not marked ended, from storage rather than the timers."""
+    if storage:
+        # Indexed query, no guild is loaded
+        return storage.active_giveaways()
+    guild_ids = {int(name) for name in (os.listdir(GUILD_DATA_DIR) if os.path.isdir(GUILD_DATA_DIR) else []) if name.isdigit()}
+    active = []
+    for guild_id in guild_ids | set(guild_shards):
+        # Loaded shards may hold changes not written yet, the others are only read, not loaded
+        giveaways = guild_shards[guild_id].giveaways if guild_id in guild_shards else load_data(guild_data_path(guild_id, 'giveaways.json'))
+        for message_id, data in giveaways.items():
+            if not data.get("ended"):
+                active.append((message_id, dict(data, guild_id=guild_id)))
+    return active
+
+def migrate_legacy_guild_data():
+    """Move data saved before per-guild partitioning into the guild shards, then make sure every
+    active giveaway has a timer (runs once, on_ready)."""
+    default_guild = legacy_default_guild()
+    giveaway_guilds = {} # message_id -> guild_id, used to fix timers that only carry the message id
+    unassigned = 0
+
+    # Both backends kept these two as global JSON files
+    for guild_id, snapshot in load_data('invite_cache.json').items():
+        os.makedirs(os.path.dirname(guild_data_path(guild_id, 'invite_cache.json')), exist_ok=True)
+        write_json_atomic(guild_data_path(guild_id, 'invite_cache.json'), snapshot)
+    retire_legacy_file('invite_cache.json')
+
+    windows = load_data('invite_windows.json')
+    if windows and default_guild is not None:
+        shard = get_shard(default_guild)
+        for user_id, state in windows.items():
+            if user_id not in shard.invite_windows:
+                shard.invite_windows[user_id] = WindowedCounter(state)
+                shard.persist_invite_window(user_id)
+        windows = {}
+    unassigned += len(windows)
+    retire_legacy_file('invite_windows.json', windows)
+
+    if storage:
+        if storage.has_legacy_data():
+            for message_id, channel_id in storage.legacy_giveaway_channels().items():
+                guild_id = legacy_giveaway_guild({"channel_id": channel_id})
+                if guild_id is not None:
+                    giveaway_guilds[message_id] = guild_id
+            storage.assign_legacy_data(default_guild, giveaway_guilds)
+            # Reloaded from the new partitions on next access
+            for guild_id in set(giveaway_guilds.values()) | {default_guild}:
+                guild_shards.pop(guild_id, None)
+            if storage.has_legacy_data():
+                unassigned += 1
+    else:
+        invites = load_data('invites.json')
+        members = load_data('member_inviters.json')
+        if (invites or members) and default_guild is not None:
+            shard = get_shard(default_guild)
+            for user_id, data in invites.items():
+                shard.invites.setdefault(user_id, data)
+                shard.persist_invites(user_id)
+            for member_id, record in members.items():
+                shard.member_inviters.setdefault(member_id, record)
+                shard.persist_member_inviter(member_id)
+            shard.leaderboard.build({user_id: get_invites(default_guild, user_id) for user_id in list(shard.invites)})
+            invites, members = {}, {}
+        unassigned += len(invites) + len(members)
+        retire_legacy_file('invites.json', invites)
+        retire_legacy_file('member_inviters.json', members)
+
+        giveaways = load_data('giveaways.json')
+        leftover = {}
+        for message_id, data in giveaways.items():
+            guild_id = legacy_giveaway_guild(data)
+            if guild_id is None:
+                leftover[message_id] = data
+                continue
+            shard = get_shard(guild_id)
+            data["guild_id"] = guild_id
+            data["participants"] = ParticipantSet(data.get("participants", []))
+            shard.giveaways.setdefault(message_id, data)
+            shard.persist_giveaway(message_id)
+            giveaway_guilds[message_id] = guild_id
+        unassigned += len(leftover)
+        retire_legacy_file('giveaways.json', leftover)
+
+    # Timers only carried the message id before partitioning, and giveaways from before the
+    # scheduler (or whose timer got lost) have no timer at all: rebuilt from the stored state
+    for message_id, data in stored_active_giveaways():
+        guild_id = int(data["guild_id"]) if data.get("guild_id") else giveaway_guilds.get(message_id)
+        job = scheduler.jobs.get(giveaway_job_id(message_id))
+        if guild_id is None or (job is not None and "guild_id" in job["payload"]):
+            continue
+        schedule_giveaway_end(guild_id, message_id, job["run_at"] if job else data["end_time"])
+
+    if unassigned:
+        print("[DATA] Some data saved before per-guild storage couldn't be assigned to a guild. Set LEGACY_GUILD_ID in .env and restart.")
+
+# --- Timer Scheduler ---
+JOB_RETRY_BASE = 30 # Seconds before a failed job runs again, doubled after every failure
+JOB_RETRY_MAX = 3600
+
+class TimerScheduler:
+    """Runs every delayed job (giveaway ends, ...) from one task and a min-heap of deadlines.
+
+    Jobs are persisted to disk so they survive restarts. Cancelled or rescheduled jobs are
+    left in the heap and skipped when popped (checked against self.jobs). A job stays in
+    self.jobs until its handler succeeds (a failure reschedules it with a backoff), so a crash
+    or an error never loses it.
+    """
+    def __init__(self, filename='scheduled_jobs.json'):
+        self.filename = filename
+        self.jobs = load_data(filename) # job_id -> {"kind": str, "run_at": unix ts, "payload": dict}
+        self.heap = [(job["run_at"], job_id) for job_id, job in self.jobs.items()]
+        heapq.heapify(self.heap)
+        self.handlers = {}
+        self.running = {} # job_id -> job dict whose handler is being awaited
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def register(self, kind, handler):
+        """handler(payload) is awaited when a job of this kind is due."""
+        self.handlers[kind] = handler
+
+    def schedule(self, job_id, kind, run_at, payload=None):
+        self.jobs[job_id] = {"kind": kind, "run_at": float(run_at), "payload": payload or {}}
+        heapq.heappush(self.heap, (float(run_at), job_id))
+        self._compact()
+        self._persist()
+        self.wakeup.set()
+
+    def reschedule(self, job_id, run_at):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        self.schedule(job_id, job["kind"], run_at, job["payload"])
+        return True
+
+    def cancel(self, job_id):
+        if self.jobs.pop(job_id, None) is None:
+            return False
+        self._persist()
+        self.wakeup.set()
+        return True
+
+    def has_job(self, job_id):
+        """A run of this job is still to come (one that is running right now doesn't count)."""
+        job = self.jobs.get(job_id)
+        return job is not None and self.running.get(job_id) is not job
+
+    @property
+    def pending_count(self):
+        return len(self.jobs)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def _persist(self):
+        save_data(self.filename, self.jobs)
+
+    def _compact(self):
+        # Drop heap entries of cancelled/rescheduled jobs once they pile up
+        if len(self.heap) > 2 * len(self.jobs) + 64:
+            self.heap = [(job["run_at"], job_id) for job_id, job in self.jobs.items() if self.has_job(job_id)]
+            heapq.heapify(self.heap)
+
+    def _is_current(self, run_at, job_id):
+        return self.has_job(job_id) and self.jobs[job_id]["run_at"] == run_at
+
+    async def _run(self):
+        while True:
+            # Skip stale entries at the top of the heap
+            while self.heap and not self._is_current(*self.heap[0]):
+                heapq.heappop(self.heap)
+
+            timeout = None
+            if self.heap:
+                timeout = self.heap[0][0] - time.time()
+
+            if timeout is None or timeout > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Out of the heap while it runs, still in self.jobs (and on disk) until it succeeded
+            run_at, job_id = heapq.heappop(self.heap)
+            self.running[job_id] = self.jobs[job_id]
+            asyncio.get_running_loop().create_task(self._execute(job_id, self.jobs[job_id]))
+
+    async def _execute(self, job_id, job):
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            print(f"[SCHEDULER] No handler for job {job_id} ({job['kind']})")
+            # Kept on disk for a restart that registers the handler
+            self.running.pop(job_id, None)
+            return
+        try:
+            await handler(job["payload"])
+        except Exception as e:
+            if self.running.get(job_id) is job:
+                del self.running[job_id]
+            if self.jobs.get(job_id) is not job:
+                # Cancelled or rescheduled by someone else meanwhile
+                return
+            attempts = job.get("attempts", 0) + 1
+            delay = min(JOB_RETRY_BASE * 2 ** (attempts - 1), JOB_RETRY_MAX)
+            print(f"[SCHEDULER] Job {job_id} failed ({e}), retrying in {delay}s")
+            self.schedule(job_id, job["kind"], time.time() + delay, job["payload"])
+            self.jobs[job_id]["attempts"] = attempts
+            self._persist()
+            return
+        if self.running.get(job_id) is job:
+            del self.running[job_id]
+        # Done, unless the handler scheduled a new run of the same job
+        if self.jobs.get(job_id) is job:
+            del self.jobs[job_id]
+            self._persist()
+
+scheduler = TimerScheduler()
+
+# --- Winner Selection ---
+# Pools at least this big use the vectorized NumPy path (when numpy is installed)
+NUMPY_POOL_THRESHOLD = 50000
+
+def get_entry_weight(guild_id, user_id):
+    """Number of entries a participant has: 1 + their bonus chances in that guild."""
+    data = get_shard(guild_id).invites.get(str(user_id))
+    chance = 1 + (data.get("bonus", 0) if data else 0)
+    return chance if chance >= 1 else 1
+
+def weighted_sample(user_ids, weights, k, rng=None):
+    """Draw k distinct users, each draw weighted among the users not picked yet.
+
+    Same distribution as the old "pool of weight copies, remove the winner" draw, without
+    ever building the pool: one cumulative-weights pass (O(n)) then a binary search per
+    draw, re-drawing when it lands on someone already picked. If one user holds most of
+    the weight and re-draws pile up, the rest is finished with Efraimidis-Spirakis keys.
+    Winners are returned in draw order.
+    """
+    user_ids = list(user_ids)
+    k = min(k, len(user_ids))
+    if k <= 0:
+        return []
+
+    if np is not None and len(user_ids) >= NUMPY_POOL_THRESHOLD:
+        # Efraimidis-Spirakis, vectorized: key = log(u) / weight, keep the k largest
+        np_rng = np.random.default_rng(None if rng is None else rng.getrandbits(64))
+        w = np.asarray(weights, dtype=np.float64)
+        keys = np.log(1.0 - np_rng.random(len(user_ids))) / w
+        top = np.argpartition(-keys, k - 1)[:k]
+        top = top[np.argsort(-keys[top])]
+        return [user_ids[i] for i in top]
+
+    rand = (rng or random).random
+    cumulative = list(itertools.accumulate(weights))
+    total = cumulative[-1]
+
+    picked = []
+    picked_index = set()
+    misses = 0
+    while len(picked) < k and misses < 32:
+        i = bisect.bisect_right(cumulative, rand() * total)
+        if i in picked_index:
+            misses += 1
+            continue
+        picked_index.add(i)
+        picked.append(user_ids[i])
+
+    if len(picked) < k:
+        # 1 - random() is in (0, 1], so log() never sees 0
+        keyed = (
+            (math.log(1.0 - rand()) / weights[i], user_ids[i])
+            for i in range(len(user_ids)) if i not in picked_index
+        )
+        picked.extend(uid for _, uid in heapq.nlargest(k - len(picked), keyed, key=lambda item: item[0]))
+    return picked
+
+def pick_giveaway_winners(guild_id, participants, winners_count):
+    return weighted_sample(participants, [get_entry_weight(guild_id, uid) for uid in participants], winners_count)
+
+# --- Giveaway Embed Updates ---
+# Minimum seconds between two "👥 Entries" edits of the same giveaway message
+ENTRY_UPDATE_INTERVAL = 5.0
+
+class EntryCountUpdater:
+    """Batches entry-count changes: each giveaway message is edited at most once per interval, with the latest count."""
+    def __init__(self, interval=ENTRY_UPDATE_INTERVAL):
+        self.interval = interval
+        self.pending = {} # message_id -> (guild_id, latest discord.Message seen)
+        self.tasks = {} # message_id -> flush task
+        self.last_edit = {} # message_id -> time.monotonic() of the last edit
+        self.requested = 0
+        self.edits = 0
+
+    def bump(self, guild_id, message):
+        self.requested += 1
+        self.pending[message.id] = (guild_id, message)
+        task = self.tasks.get(message.id)
+        if task is None or task.done():
+            self.tasks[message.id] = asyncio.get_running_loop().create_task(self._flush_later(message.id))
+
+    def discard(self, message_id):
+        """Forget pending updates (giveaway ended)."""
+        message_id = int(message_id)
+        self.pending.pop(message_id, None)
+        self.last_edit.pop(message_id, None)
+        task = self.tasks.pop(message_id, None)
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+
+    async def _flush_later(self, message_id):
+        wait = self.interval - (time.monotonic() - self.last_edit.get(message_id, 0))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        # Joins arriving from now on schedule the next flush
+        self.tasks.pop(message_id, None)
+        pending = self.pending.pop(message_id, None)
+        if pending is None:
+            return
+        guild_id, message = pending
+        giveaway = get_shard(guild_id).giveaways.get(str(message_id))
+        if not giveaway or giveaway["ended"] or not message.embeds:
+            return
+
+        embed = message.embeds[0]
+        for i, field in enumerate(embed.fields):
+            if "Entries" in field.name:
+                embed.set_field_at(i, name="👥 Entries", value=str(len(giveaway["participants"])), inline=True)
+                break
+        else:
+            return
+
+        self.last_edit[message_id] = time.monotonic()
+        try:
+            await message.edit(embed=embed)
+            self.edits += 1
+        except Exception as e:
+            print(f"[WARNING] Could not update giveaway entries count: {e}")
+
+    def summary(self):
+        return f"Entry updates: {self.requested} | Message edits: {self.edits}"
+
+entry_updater = EntryCountUpdater()
+
 # --- Giveaway System ---
 class GiveawayJoinButton(discord.ui.View):
     def __init__(self, message_id, required_invites):
@@ -82,13 +1331,14 @@ class GiveawayJoinButton(discord.ui.View):
     async def join_giveaway(self, interaction: discord.Interaction, button: discord.ui.Button):
         # Determine giveaway ID from message
         giveaway_id = str(interaction.message.id)
+        shard = get_shard(interaction.guild_id)
         
         # Check if giveaway exists
-        if giveaway_id not in giveaways_data:
+        if giveaway_id not in shard.giveaways:
             await interaction.response.send_message("❌ This giveaway has ended or does not exist.", ephemeral=True)
             return
 
-        giveaway = giveaways_data[giveaway_id]
+        giveaway = shard.giveaways[giveaway_id]
         
         if giveaway["ended"]:
             await interaction.response.send_message("❌ This giveaway has already ended.", ephemeral=True)
@@ -101,30 +1351,935 @@ class GiveawayJoinButton(discord.ui.View):
             await interaction.response.send_message("⚠️ You have already joined this giveaway!", ephemeral=True)
             return
 
-        # Check invites
-        user_invites = get_invites(user_id)
-        if user_invites < self.required_invites:
-            await interaction.response.send_message(f"❌ You need **{self.required_invites}** invites to join. You currently have **{user_invites}**.", ephemeral=True)
+        # Check invites (read from the giveaway, every giveaway shares this button's custom_id)
+        required_invites = giveaway.get("required_invites", self.required_invites)
+        window_days = giveaway.get("invite_window_days", 0)
+        if window_days:
+            user_invites = get_windowed_invites(interaction.guild_id, user_id, window_days)
+        else:
+            user_invites = get_invites(interaction.guild_id, user_id)
+        if user_invites < required_invites:
+            period = f" in the last **{window_days}** day(s)" if window_days else ""
+            await interaction.response.send_message(f"❌ You need **{required_invites}** invites{period} to join. You currently have **{user_invites}**.", ephemeral=True)
             return
 
         # Add to participants
-        giveaway["participants"].append(user_id)
-        save_data('giveaways.json', giveaways_data)
-        
-        # Update Embed count
-        embed = interaction.message.embeds[0]
-        field_index = -1
-        for i, field in enumerate(embed.fields):
-            if "Entries" in field.name:
-                field_index = i
-                break
+        giveaway["participants"].add(user_id)
+        shard.persist_participant(giveaway_id, user_id)
         
-        if field_index != -1:
-            embed.set_field_at(field_index, name="👥 Entries", value=str(len(giveaway["participants"])), inline=True)
-            await interaction.message.edit(embed=embed)
+        # Update Embed count (batched, see EntryCountUpdater)
+        entry_updater.bump(interaction.guild_id, interaction.message)
 
         await interaction.response.send_message(f"✅ You successfully joined the giveaway! (Invites: {user_invites})", ephemeral=True)
 
+# --- Category Allocator ---
+CATEGORY_CHANNEL_LIMIT = 50 # Discord's max channels per category
+# A handed out slot counts as used until its channel shows up in the category (or this many seconds pass)
+CATEGORY_RESERVATION_TTL = 60.0
+
+def category_family(name):
+    """'Ticket Logs3' -> ('Ticket Logs', 3), 'Orders' -> ('Orders', 0)."""
+    base = name.rstrip("0123456789")
+    suffix = name[len(base):]
+    return base, int(suffix) if suffix else 0
+
+def category_name(base, index):
+    return base if index == 0 else f"{base}{index}"
+
+class CategoryAllocator:
+    """Picks a category with room for one more channel in a family ("Orders", "Orders1", "Orders2", ...).
+
+    Occupancy is counted once per guild from the channel cache and then kept up to date from
+    channel create / update / delete events, so picking is a dict lookup instead of probing every
+    category. Overflow categories are created on demand, once, even if several clicks need one.
+    """
+    def __init__(self, limit=CATEGORY_CHANNEL_LIMIT):
+        self.limit = limit
+        self.guilds = {} # guild_id -> {"families": {base: {index: category_id}}, "family_of": {category_id: (base, index)}, "counts": {category_id: n}}
+        self.reserved = {} # category_id -> deque of time.monotonic() of slots handed out
+        self.first_free = {} # (guild_id, base) -> lowest index that may have room
+        self.creating = {} # (guild_id, name) -> creation task
+        self.created = 0
+
+    def _state(self, guild):
+        state = self.guilds.get(guild.id)
+        if state is None:
+            state = self.guilds[guild.id] = {"families": {}, "family_of": {}, "counts": {}}
+            for category in guild.categories:
+                self._register(guild.id, state, category)
+            for channel in guild.channels:
+                if channel.category_id and not isinstance(channel, discord.CategoryChannel):
+                    state["counts"][channel.category_id] = state["counts"].get(channel.category_id, 0) + 1
+        return state
+
+    def _register(self, guild_id, state, category):
+        base, index = category_family(category.name)
+        family = state["families"].setdefault(base, {})
+        # Two categories with the same name: keep the first one
+        family.setdefault(index, category.id)
+        if family[index] == category.id:
+            state["family_of"][category.id] = (base, index)
+            state["counts"].setdefault(category.id, 0)
+            self._mark_free(guild_id, base, index)
+
+    def _unregister(self, state, category_id):
+        base, index = state["family_of"].pop(category_id, (None, None))
+        if base is not None and state["families"][base].get(index) == category_id:
+            del state["families"][base][index]
+        state["counts"].pop(category_id, None)
+        self.reserved.pop(category_id, None)
+
+    def _mark_free(self, guild_id, base, index):
+        key = (guild_id, base)
+        self.first_free[key] = min(self.first_free.get(key, index), index)
+
+    def _used(self, category_id, state):
+        reservations = self.reserved.get(category_id)
+        if reservations:
+            while reservations and time.monotonic() - reservations[0] > CATEGORY_RESERVATION_TTL:
+                reservations.popleft()
+        return state["counts"].get(category_id, 0) + (len(reservations) if reservations else 0)
+
+    async def allocate(self, guild, base, private=True):
+        """Category of the base family with a free slot (created if needed). The slot is reserved.
+
+        private: new categories are hidden from @everyone.
+        """
+        index = self.first_free.get((guild.id, base), 0)
+        while True:
+            state = self._state(guild)
+            category_id = state["families"].get(base, {}).get(index)
+            if category_id is None:
+                await self._create(guild, category_name(base, index), private)
+                continue
+            category = guild.get_channel(category_id)
+            if category is None:
+                # Deleted without us seeing the event
+                self._unregister(state, category_id)
+                continue
+            if self._used(category_id, state) < self.limit:
+                break
+            index += 1
+
+        self.first_free[(guild.id, base)] = index
+        self.reserved.setdefault(category_id, deque()).append(time.monotonic())
+        return category
+
+    async def _create(self, guild, name, private):
+        # Single flight: concurrent callers wait for the same create_category() call
+        key = (guild.id, name)
+        task = self.creating.get(key)
+        if task is None:
+            task = self.creating[key] = asyncio.ensure_future(self._create_category(guild, name, private))
+            task.add_done_callback(lambda _: self.creating.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _create_category(self, guild, name, private):
+        overwrites = {guild.default_role: discord.PermissionOverwrite(view_channel=False)} if private else {}
+        category = await guild.create_category(name, overwrites=overwrites)
+        self.created += 1
+        # Don't wait for the gateway event
+        self._register(guild.id, self._state(guild), category)
+        return category
+
+    # Kept in sync from the channel events
+    def channel_created(self, channel):
+        state = self.guilds.get(channel.guild.id)
+        if state is None:
+            return
+        if isinstance(channel, discord.CategoryChannel):
+            self._register(channel.guild.id, state, channel)
+        elif channel.category_id:
+            self._add(state, channel.category_id)
+
+    def channel_deleted(self, channel):
+        state = self.guilds.get(channel.guild.id)
+        if state is None:
+            return
+        if isinstance(channel, discord.CategoryChannel):
+            self._unregister(state, channel.id)
+        elif channel.category_id:
+            self._remove(channel.guild.id, state, channel.category_id)
+
+    def channel_updated(self, before, after):
+        state = self.guilds.get(after.guild.id)
+        if state is None:
+            return
+        if isinstance(after, discord.CategoryChannel):
+            if before.name != after.name:
+                self._unregister(state, after.id)
+                self._register(after.guild.id, state, after)
+        elif before.category_id != after.category_id:
+            if before.category_id:
+                self._remove(after.guild.id, state, before.category_id)
+            if after.category_id:
+                self._add(state, after.category_id)
+
+    def _add(self, state, category_id):
+        if category_id not in state["counts"]:
+            return
+        state["counts"][category_id] += 1
+        # The channel a reservation was made for (or close enough) has arrived
+        reservations = self.reserved.get(category_id)
+        if reservations:
+            reservations.popleft()
+
+    def _remove(self, guild_id, state, category_id):
+        if category_id not in state["counts"]:
+            return
+        state["counts"][category_id] = max(state["counts"][category_id] - 1, 0)
+        base, index = state["family_of"][category_id]
+        self._mark_free(guild_id, base, index)
+
+category_allocator = CategoryAllocator()
+
+def order_category_name(item_str):
+    """Category family an order ticket is moved to."""
+    if "Gifting" in item_str:
+        return "Gifting Orders"
+    if "VP" in item_str or "Valorant" in item_str:
+        return "Valorant Orders"
+    if "Nitro" in item_str:
+        return "Nitro Orders"
+    if "V-Bucks" in item_str:
+        return "Fortnite Orders"
+    return "Orders" # Default
+
+# --- Open Ticket Index ---
+# Category families an open ticket can sit in (it moves out of "Tickets" once a service is picked)
+# Only tickets still in the "Tickets" categories count as open: once moved to an order or
+# support category the customer may open a new one (same rule as the old category scan)
+OPEN_TICKET_CATEGORIES = ("Tickets",)
+
+class OpenTicketIndex:
+    """Open ticket channel per user, so "already has a ticket" is a dict lookup instead of a category scan.
+
+    Updated on create / close / reopen / delete, persisted to open_tickets.json and reconciled
+    against the cached channels at startup.
+    """
+    def __init__(self, filename='open_tickets.json'):
+        self.filename = filename
+        self.tickets = load_data(filename) # "guild_id" -> {"user_id": channel_id}
+        self.channels = {} # channel_id -> (guild_id, user_id)
+        for guild_id, users in self.tickets.items():
+            for user_id, channel_id in users.items():
+                self.channels[channel_id] = (guild_id, user_id)
+        self.creating = set() # (guild_id, user_id) whose ticket channel is being created right now
+
+    def get(self, guild_id, user_id):
+        return self.tickets.get(str(guild_id), {}).get(str(user_id))
+
+    def reserve(self, guild_id, user_id):
+        """Claim the right to create a ticket (False if one is open or already being created)."""
+        key = (str(guild_id), str(user_id))
+        if key in self.creating or self.get(*key) is not None:
+            return False
+        self.creating.add(key)
+        return True
+
+    def release(self, guild_id, user_id):
+        self.creating.discard((str(guild_id), str(user_id)))
+
+    def open(self, guild_id, user_id, channel_id):
+        guild_id, user_id = str(guild_id), str(user_id)
+        old_channel = self.get(guild_id, user_id)
+        if old_channel is not None:
+            self.channels.pop(old_channel, None)
+        self.tickets.setdefault(guild_id, {})[user_id] = channel_id
+        self.channels[channel_id] = (guild_id, user_id)
+        self._persist()
+
+    def close_channel(self, channel_id):
+        """Forget the ticket living in this channel. Returns the owner's id (str) or None."""
+        entry = self.channels.pop(channel_id, None)
+        if entry is None:
+            return None
+        guild_id, user_id = entry
+        users = self.tickets.get(guild_id, {})
+        if users.get(user_id) == channel_id:
+            del users[user_id]
+            if not users:
+                self.tickets.pop(guild_id, None)
+        self._persist()
+        return user_id
+
+    def reconcile(self, guild):
+        """Sync with the guild's cached channels (no API calls): drop tickets whose channel is gone
+        or closed, add open ticket channels the index doesn't know."""
+        changed = False
+        for user_id, channel_id in list(self.tickets.get(str(guild.id), {}).items()):
+            channel = guild.get_channel(channel_id)
+            if channel is None or channel.category is None or category_family(channel.category.name)[0] not in OPEN_TICKET_CATEGORIES:
+                self.close_channel(channel_id)
+                changed = True
+
+        for category in guild.categories:
+            if category_family(category.name)[0] not in OPEN_TICKET_CATEGORIES:
+                continue
+            for channel in category.text_channels:
+                if channel.id in self.channels:
+                    continue
+                for target, overwrite in channel.overwrites.items():
+                    # Owner = the member allowed to see the channel (targets can be Objects when not cached)
+                    if isinstance(target, discord.Role) or target.id == guild.me.id or not overwrite.view_channel:
+                        continue
+                    if self.get(guild.id, target.id) is None:
+                        self.tickets.setdefault(str(guild.id), {})[str(target.id)] = channel.id
+                        self.channels[channel.id] = (str(guild.id), str(target.id))
+                        changed = True
+                    break
+        if changed:
+            self._persist()
+
+    def _persist(self):
+        save_data(self.filename, self.tickets)
+
+open_tickets = OpenTicketIndex()
+
+# --- Ticket Metadata ---
+class TicketStore:
+    """Per ticket channel: owner, service, package, payment method and timestamps.
+
+    Recorded as the ticket moves along (create -> service -> order) so closing it doesn't need
+    to read the channel history back. Persisted to tickets.json, dropped when the channel is deleted.
+    """
+    def __init__(self, filename='tickets.json'):
+        self.filename = filename
+        self.tickets = load_data(filename) # "channel_id" -> metadata dict
+
+    def get(self, channel_id):
+        return self.tickets.get(str(channel_id))
+
+    def create(self, channel, owner):
+        now = int(time.time())
+        self.tickets[str(channel.id)] = {
+            "guild_id": channel.guild.id,
+            "owner_id": owner.id,
+            "owner_name": owner.name,
+            "service": None,
+            "package": None,
+            "payment_method": None,
+            "created_at": now,
+            "updated_at": now,
+            "closed_at": None
+        }
+        self._persist()
+
+    def update(self, channel_id, **fields):
+        ticket = self.get(channel_id)
+        if ticket is None:
+            # Ticket opened before metadata was recorded
+            return
+        ticket.update(fields)
+        ticket["updated_at"] = int(time.time())
+        self._persist()
+
+    def remove(self, channel_id):
+        if self.tickets.pop(str(channel_id), None) is not None:
+            self._persist()
+
+    def _persist(self):
+        save_data(self.filename, self.tickets)
+
+ticket_store = TicketStore()
+
+def ticket_order_info(ticket):
+    """Order summary shown on the closed ticket embed."""
+    if not ticket or not (ticket.get("package") or ticket.get("service")):
+        return "General Support / No Order Found"
+    info = f"**{ticket.get('package') or ticket['service']}**"
+    if ticket.get("payment_method"):
+        info += f"\n💳 {ticket['payment_method']}"
+    return info
+
+# --- Ticket Transcripts ---
+# Closed tickets can be archived to a transcript (JSONL.gz + HTML) posted in one log channel,
+# then deleted, instead of being kept as channels in the "Ticket Logs" categories
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "transcripts")
+TRANSCRIPT_CHANNEL = os.getenv("TRANSCRIPT_CHANNEL", "ticket-transcripts")
+# Archive straight away on close (otherwise tickets go to Ticket Logs and can be archived later)
+ARCHIVE_ON_CLOSE = os.getenv("ARCHIVE_ON_CLOSE", "false").lower() in ("1", "true", "yes")
+ARCHIVE_CONCURRENCY = 2 # Channels archived at the same time by the backfill
+TRANSCRIPT_UPLOAD_LIMIT = 8 * 1024 * 1024 # Bigger files are kept locally only
+
+def transcript_message_record(msg):
+    return {
+        "type": "message",
+        "id": msg.id,
+        "author_id": msg.author.id,
+        "author": msg.author.name,
+        "bot": msg.author.bot,
+        "created_at": msg.created_at.isoformat(),
+        "content": msg.content,
+        "embeds": [
+            {
+                "title": embed.title,
+                "description": embed.description,
+                "fields": [{"name": field.name, "value": field.value} for field in embed.fields]
+            }
+            for embed in msg.embeds
+        ],
+        "attachments": [attachment.url for attachment in msg.attachments]
+    }
+
+def render_transcript_html(jsonl_path, html_path):
+    """Render the JSONL.gz transcript as a standalone HTML page, one record at a time."""
+    with gzip.open(jsonl_path, 'rt', encoding='utf-8') as src, open(html_path, 'w', encoding='utf-8') as out:
+        header = json.loads(src.readline())
+        title = html.escape(f"#{header['channel_name']}")
+        out.write(
+            f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{title}</title><style>"
+            "body{font-family:sans-serif;background:#313338;color:#dbdee1;margin:2em}"
+            ".msg{margin:.6em 0}.author{font-weight:bold;color:#fff}.bot{color:#5865f2}"
+            ".time{color:#949ba4;font-size:.8em;margin-left:.5em}.embed{border-left:4px solid #5865f2;"
+            "background:#2b2d31;padding:.4em .8em;margin:.3em 0;white-space:pre-wrap}.content{white-space:pre-wrap}"
+            "</style></head><body>"
+        )
+        out.write(f"<h1>{title}</h1><p>")
+        for label, key in (("Owner", "owner_name"), ("Service", "service"), ("Package", "package"), ("Payment", "payment_method"), ("Closed by", "closed_by")):
+            if header.get(key):
+                out.write(f"<b>{label}:</b> {html.escape(str(header[key]))}<br>")
+        out.write("</p><hr>")
+        for line in src:
+            record = json.loads(line)
+            author_class = "author bot" if record["bot"] else "author"
+            out.write(
+                f"<div class='msg'><span class='{author_class}'>{html.escape(record['author'])}</span>"
+                f"<span class='time'>{html.escape(record['created_at'][:19].replace('T', ' '))}</span>"
+            )
+            if record["content"]:
+                out.write(f"<div class='content'>{html.escape(record['content'])}</div>")
+            for embed in record["embeds"]:
+                parts = [embed["title"], embed["description"]] + [f"{f['name']}: {f['value']}" for f in embed["fields"]]
+                out.write(f"<div class='embed'>{html.escape(chr(10).join(p for p in parts if p))}</div>")
+            for url in record["attachments"]:
+                url = html.escape(url, quote=True)
+                out.write(f"<div><a href='{url}'>{url}</a></div>")
+            out.write("</div>")
+        out.write("</body></html>")
+
+class TranscriptArchiver:
+    """Streams a ticket's history to disk, posts the transcript to the log channel, deletes the ticket."""
+    def __init__(self):
+        self.archiving = set() # channel ids in progress
+        self.log_channels = {} # guild_id -> transcript channel id
+        self.locks = {} # guild_id -> lock around creating the transcript channel
+        self.archived = 0
+
+    async def log_channel(self, guild):
+        channel = guild.get_channel(self.log_channels.get(guild.id, 0))
+        if channel:
+            return channel
+        async with self.locks.setdefault(guild.id, asyncio.Lock()):
+            channel = discord.utils.get(guild.text_channels, name=TRANSCRIPT_CHANNEL)
+            if channel is None:
+                overwrites = {
+                    guild.default_role: discord.PermissionOverwrite(view_channel=False),
+                    guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, attach_files=True)
+                }
+                channel = await guild.create_text_channel(TRANSCRIPT_CHANNEL, overwrites=overwrites)
+            self.log_channels[guild.id] = channel.id
+            return channel
+
+    async def write_transcript(self, channel, header):
+        """Write the header then every message (oldest first) as JSONL.gz. Returns (jsonl path, html path, message count)."""
+        folder = os.path.join(TRANSCRIPT_DIR, str(channel.guild.id))
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, f"{channel.id}-{channel.name}")
+        jsonl_path, html_path = f"{base}.jsonl.gz", f"{base}.html"
+
+        count = 0
+        with gzip.open(jsonl_path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(header) + "\n")
+            # Streamed page by page, never held in memory all at once
+            async for msg in channel.history(limit=None, oldest_first=True):
+                f.write(json.dumps(transcript_message_record(msg)) + "\n")
+                count += 1
+        await asyncio.to_thread(render_transcript_html, jsonl_path, html_path)
+        return jsonl_path, html_path, count
+
+    async def archive(self, channel, closed_by=None):
+        """Returns the number of messages archived, or None if the channel was skipped."""
+        if channel.id in self.archiving:
+            return None
+        self.archiving.add(channel.id)
+        try:
+            ticket = ticket_store.get(channel.id) or {}
+            header = {
+                "type": "ticket",
+                "guild_id": channel.guild.id,
+                "channel_id": channel.id,
+                "channel_name": channel.name,
+                "owner_id": ticket.get("owner_id"),
+                "owner_name": ticket.get("owner_name"),
+                "service": ticket.get("service"),
+                "package": ticket.get("package"),
+                "payment_method": ticket.get("payment_method"),
+                "created_at": ticket.get("created_at") or int(channel.created_at.timestamp()),
+                "closed_at": ticket.get("closed_at") or int(time.time()),
+                "closed_by": closed_by.name if closed_by else None,
+                "archived_at": int(time.time())
+            }
+            jsonl_path, html_path, count = await self.write_transcript(channel, header)
+            try:
+                await asyncio.to_thread(transcript_index.add, jsonl_path)
+            except Exception as e:
+                # Picked up by index_missing() on the next start
+                print(f"[TRANSCRIPT] Indexing {jsonl_path} failed: {e}")
+
+            embed = discord.Embed(title=f"🗄️ Transcript: #{channel.name}", color=0x95A5A6, timestamp=datetime.now())
+            embed.add_field(name="👤 Ticket Owner", value=f"<@{header['owner_id']}>" if header["owner_id"] else "Unknown", inline=True)
+            embed.add_field(name="💬 Messages", value=str(count), inline=True)
+            if closed_by:
+                embed.add_field(name="🛡️ Closed By", value=closed_by.mention, inline=True)
+            embed.add_field(name="📝 Order Info", value=ticket_order_info(ticket), inline=False)
+
+            files = [
+                discord.File(path)
+                for path in (html_path, jsonl_path)
+                if os.path.getsize(path) <= TRANSCRIPT_UPLOAD_LIMIT
+            ]
+            if len(files) < 2:
+                embed.set_footer(text="Transcript too big to upload, kept on the bot's disk")
+            log_channel = await self.log_channel(channel.guild)
+            await log_channel.send(embed=embed, files=files)
+
+            await channel.delete(reason="Ticket archived to transcript.")
+            self.archived += 1
+            return count
+        finally:
+            self.archiving.discard(channel.id)
+
+    async def backfill(self, guild, progress=None, concurrency=ARCHIVE_CONCURRENCY):
+        """Archive every channel left in the Ticket Logs categories, a few at a time.
+
+        progress(done, total) is awaited after each channel. Returns (archived, failed).
+        """
+        queue = asyncio.Queue()
+        for category in guild.categories:
+            if category_family(category.name)[0] == "Ticket Logs":
+                for channel in category.text_channels:
+                    queue.put_nowait(channel)
+        total = queue.qsize()
+        done = failed = 0
+
+        async def worker():
+            nonlocal done, failed
+            while not queue.empty():
+                channel = queue.get_nowait()
+                try:
+                    await self.archive(channel)
+                except discord.NotFound:
+                    pass
+                except Exception as e:
+                    failed += 1
+                    print(f"[TRANSCRIPT] Archiving {channel.name} failed: {e}")
+                done += 1
+                if progress:
+                    await progress(done, total)
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+        return done - failed, failed
+
+transcript_archiver = TranscriptArchiver()
+
+# --- Transcript Search ---
+TRANSCRIPT_INDEX_PATH = os.path.join(TRANSCRIPT_DIR, "search.db")
+TRANSCRIPT_SEARCH_PAGE_SIZE = 5
+
+TRANSCRIPT_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL UNIQUE,
+    guild_id TEXT NOT NULL,
+    channel_name TEXT,
+    owner_id TEXT,
+    owner_name TEXT,
+    service TEXT,
+    package TEXT,
+    payment_method TEXT,
+    closed_at INTEGER,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transcripts_guild ON transcripts(guild_id, owner_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcript_fts USING fts5(
+    channel_name, owner_name, service, package, payment_method, content,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+def transcript_search_text(record):
+    """Searchable text of one transcript message (content + embeds)."""
+    parts = [record["content"]]
+    for embed in record["embeds"]:
+        parts.extend([embed["title"], embed["description"]])
+        parts.extend(f"{field['name']} {field['value']}" for field in embed["fields"])
+    return "\n".join(part for part in parts if part)
+
+class TranscriptIndex:
+    """SQLite FTS5 index over archived transcripts: ticket metadata + every message's text.
+
+    A transcript is indexed right after it's written (from worker threads, one at a time through
+    the lock), search runs on the event loop on its own read connection. The database is only
+    opened on first use, so importing the bot doesn't create it (or need FTS5).
+    """
+    def __init__(self, path=TRANSCRIPT_INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.writer = None
+        self.reader = None
+
+    def _connect(self, **kwargs):
+        conn = sqlite3.connect(self.path, isolation_level=None, **kwargs)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _write_conn(self):
+        """Shared by the worker threads, only use it with self.lock held."""
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = self._connect(check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(TRANSCRIPT_INDEX_SCHEMA)
+            self.writer = conn
+        return self.writer
+
+    def _read_conn(self):
+        """Event loop only. WAL lets it read while a worker thread is in a write transaction."""
+        if self.reader is None:
+            with self.lock:
+                # Creates the file and tables if nothing was indexed yet
+                self._write_conn()
+            self.reader = self._connect()
+        return self.reader
+
+    def add(self, path):
+        """Index one JSONL.gz transcript (replaces a previous version of the same ticket)."""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            texts = [transcript_search_text(json.loads(line)) for line in f]
+
+        with self.lock:
+            self._replace(header, texts, path)
+
+    def _replace(self, header, texts, path):
+        conn = self._write_conn()
+        with conn:
+            conn.execute("BEGIN")
+            old = conn.execute("SELECT id FROM transcripts WHERE channel_id = ?", (str(header["channel_id"]),)).fetchone()
+            if old:
+                conn.execute("DELETE FROM transcript_fts WHERE rowid = ?", (old["id"],))
+                conn.execute("DELETE FROM transcripts WHERE id = ?", (old["id"],))
+            cursor = conn.execute(
+                "INSERT INTO transcripts (channel_id, guild_id, channel_name, owner_id, owner_name, service, package, payment_method, closed_at, message_count, path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(header["channel_id"]), str(header["guild_id"]), header["channel_name"],
+                    str(header["owner_id"]) if header.get("owner_id") else None, header.get("owner_name"),
+                    header.get("service"), header.get("package"), header.get("payment_method"),
+                    header.get("closed_at"), len(texts), path
+                )
+            )
+            conn.execute(
+                "INSERT INTO transcript_fts (rowid, channel_name, owner_name, service, package, payment_method, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    cursor.lastrowid, header["channel_name"], header.get("owner_name"), header.get("service"),
+                    header.get("package"), header.get("payment_method"), "\n".join(texts)
+                )
+            )
+
+    def index_missing(self, directory=TRANSCRIPT_DIR):
+        """Index transcript files written before the index existed (or while it was unavailable)."""
+        with self.lock:
+            known = {row["path"] for row in self._write_conn().execute("SELECT path FROM transcripts")}
+        added = 0
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(".jsonl.gz") and path not in known:
+                    try:
+                        self.add(path)
+                        added += 1
+                    except Exception as e:
+                        print(f"[TRANSCRIPT] Could not index {path}: {e}")
+        return added
+
+    def _match(self, sql, params):
+        """params[0] is the MATCH query."""
+        conn = self._read_conn()
+        try:
+            return conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            # Not valid FTS syntax (quotes, dashes, ...): search the words as plain terms
+            quoted = " ".join('"' + word.replace('"', '""') + '"' for word in params[0].split())
+            return conn.execute(sql, [quoted] + params[1:]).fetchall()
+
+    def search(self, guild_id, query, owner_id=None, page=0, page_size=TRANSCRIPT_SEARCH_PAGE_SIZE):
+        """Best matches first. Returns (total matches, rows of this page)."""
+        where = "transcript_fts MATCH ? AND t.guild_id = ?"
+        params = [query, str(guild_id)]
+        if owner_id is not None:
+            where += " AND t.owner_id = ?"
+            params.append(str(owner_id))
+
+        total = self._match(
+            f"SELECT COUNT(*) AS n FROM transcript_fts JOIN transcripts t ON t.id = transcript_fts.rowid WHERE {where}",
+            params
+        )[0]["n"]
+        rows = self._match(
+            "SELECT t.*, snippet(transcript_fts, -1, '**', '**', '…', 16) AS excerpt "
+            f"FROM transcript_fts JOIN transcripts t ON t.id = transcript_fts.rowid WHERE {where} "
+            "ORDER BY bm25(transcript_fts) LIMIT ? OFFSET ?",
+            params + [page_size, page * page_size]
+        )
+        return total, rows
+
+transcript_index = TranscriptIndex()
+
+# --- Channel Renames ---
+RENAME_BUDGET = 2 # Discord allows 2 renames per channel...
+RENAME_WINDOW = 600 # ...per 10 minutes
+
+def rename_job_id(channel_id):
+    return f"channel_rename:{channel_id}"
+
+class ChannelRenameQueue:
+    """Latest-wins channel renames that respect the per-channel rename budget.
+
+    request() never waits: the rename is applied in the background when the channel has budget
+    left, otherwise it becomes the channel's pending name and a scheduler job applies it when the
+    oldest rename leaves the window. A newer request just replaces the pending name.
+    """
+    def __init__(self, filename='channel_renames.json'):
+        self.filename = filename
+        self.renames = load_data(filename) # "channel_id" -> {"times": [unix ts of recent renames], "pending": name or None}
+        self.inflight = set()
+        self.applied = 0
+        self.collapsed = 0
+        self.deferred = 0
+
+    def _recent(self, entry):
+        now = time.time()
+        entry["times"] = [t for t in entry["times"] if now - t < RENAME_WINDOW]
+        return entry["times"]
+
+    def request(self, channel, name):
+        """Queue a rename, returns the unix time it should be applied at."""
+        key = str(channel.id)
+        entry = self.renames.setdefault(key, {"times": [], "pending": None})
+        if entry["pending"] is not None:
+            self.collapsed += 1
+        name = name[:100]
+        if name == channel.name and key not in self.inflight:
+            # Back to the current name: nothing left to apply
+            entry["pending"] = None
+            scheduler.cancel(rename_job_id(key))
+            self._persist()
+            return time.time()
+        entry["pending"] = name
+        self._persist()
+        return self._dispatch(key)
+
+    def _dispatch(self, key):
+        entry = self.renames.get(key)
+        if entry is None or entry["pending"] is None:
+            return time.time()
+        recent = self._recent(entry)
+        if len(recent) >= RENAME_BUDGET:
+            run_at = recent[0] + RENAME_WINDOW
+            if not scheduler.has_job(rename_job_id(key)):
+                self.deferred += 1
+                scheduler.schedule(rename_job_id(key), "channel_rename", run_at, {"channel_id": key})
+            return run_at
+        if key not in self.inflight:
+            # Whatever is pending when the running rename finishes is applied right after it
+            asyncio.get_running_loop().create_task(self._apply(key))
+        return time.time()
+
+    async def _apply(self, key):
+        entry = self.renames.get(key)
+        channel = bot.get_channel(int(key))
+        if channel is None:
+            self.forget(key)
+            return
+        if entry is None or entry["pending"] is None or key in self.inflight:
+            return
+        if len(self._recent(entry)) >= RENAME_BUDGET:
+            self._dispatch(key)
+            return
+
+        name = entry["pending"]
+        if channel.name != name:
+            self.inflight.add(key)
+            entry["times"].append(time.time())
+            try:
+                await channel.edit(name=name)
+                self.applied += 1
+            except discord.NotFound:
+                self.forget(key)
+                return
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    # Renamed by someone else in the meantime: retry when Discord says so
+                    retry_after = float(e.response.headers.get("Retry-After", RENAME_WINDOW) or RENAME_WINDOW)
+                    scheduler.schedule(rename_job_id(key), "channel_rename", time.time() + retry_after, {"channel_id": key})
+                    return
+                print(f"[WARNING] Rename of {channel.name} to {name} failed: {e}")
+            finally:
+                self.inflight.discard(key)
+
+        if entry["pending"] == name:
+            entry["pending"] = None
+        self._persist()
+        self._dispatch(key)
+
+    def claim(self, channel, name):
+        """Take one rename from the budget for an edit the caller makes itself (ChannelMutation).
+
+        False when the rename can't go out now: it is queued like request() instead.
+        """
+        key = str(channel.id)
+        name = name[:100]
+        entry = self.renames.setdefault(key, {"times": [], "pending": None})
+        if name != channel.name and key not in self.inflight and len(self._recent(entry)) < RENAME_BUDGET:
+            entry["times"].append(time.time())
+            entry["pending"] = None
+            scheduler.cancel(rename_job_id(key))
+            self.applied += 1
+            self._persist()
+            return True
+        self.request(channel, name)
+        return False
+
+    def pending_name(self, channel_id):
+        entry = self.renames.get(str(channel_id))
+        return entry["pending"] if entry else None
+
+    def forget(self, channel_id):
+        key = str(channel_id)
+        scheduler.cancel(rename_job_id(key))
+        if self.renames.pop(key, None) is not None:
+            self._persist()
+
+    def resume(self):
+        """Pending renames whose background edit was interrupted by a restart."""
+        for key, entry in list(self.renames.items()):
+            if entry["pending"] is not None and not scheduler.has_job(rename_job_id(key)):
+                self._dispatch(key)
+
+    def summary(self):
+        pending = sum(1 for entry in self.renames.values() if entry["pending"] is not None)
+        return f"Renames: {self.applied} applied, {self.collapsed} collapsed, {self.deferred} deferred, {pending} pending"
+
+    def _persist(self):
+        # Channels with nothing pending are only kept while their renames count against the budget
+        now = time.time()
+        for key in [k for k, e in self.renames.items() if e["pending"] is None and all(now - t >= RENAME_WINDOW for t in e["times"])]:
+            del self.renames[key]
+        save_data(self.filename, self.renames)
+
+rename_queue = ChannelRenameQueue()
+
+async def run_channel_rename_job(payload):
+    await rename_queue._apply(payload["channel_id"])
+
+scheduler.register("channel_rename", run_channel_rename_job)
+
+# --- Channel Mutations ---
+class ChannelMutation:
+    """Name, category and permission changes for one channel, sent as a single channel.edit.
+
+    Each change stands for the REST call it used to cost; whatever is batched beyond the first
+    is counted as saved. The name only joins the edit when the rename budget allows it and no
+    permissions change: discord.py waits out a rename 429 inside edit(), which must never hold
+    back closing (or opening) a ticket. Otherwise it goes to the rename queue after the edit.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.name = None
+        self.category = None
+        self.overwrites = None
+
+    def rename(self, name):
+        self.name = name[:100]
+        return self
+
+    def move(self, category):
+        self.category = category
+        return self
+
+    def set_permissions(self, target, **permissions):
+        # Same semantics as channel.set_permissions: the target's overwrite is replaced
+        if self.overwrites is None:
+            self.overwrites = {}
+        self.overwrites[target] = discord.PermissionOverwrite(**permissions)
+        return self
+
+    async def apply(self, reason=None):
+        fields = {}
+        calls = 0
+        if self.category is not None and self.category != self.channel.category:
+            fields["category"] = self.category
+            calls += 1
+        if self.overwrites:
+            fields["overwrites"] = {**self.channel.overwrites, **self.overwrites}
+            calls += len(self.overwrites)
+        # Our rename budget only counts the bot's own renames, so never risk the permissions on it
+        claimed = self.name is not None and not self.overwrites and rename_queue.claim(self.channel, self.name)
+        if claimed:
+            fields["name"] = self.name
+            calls += 1
+        if fields:
+            try:
+                await self.channel.edit(reason=reason, **fields)
+            except Exception:
+                if claimed:
+                    rename_queue.request(self.channel, self.name)
+                raise
+            channel_mutations.record(self.channel.id, calls - 1)
+        if self.name is not None and not claimed:
+            # Separate, last and in the background (applied when the budget allows)
+            rename_queue.request(self.channel, self.name)
+
+class ChannelMutationStats:
+    """REST calls saved by ChannelMutation, in total and per ticket lifecycle.
+
+    Running per-channel counts are folded into a lifecycle sum when the channel is deleted,
+    so the per-ticket average covers finished tickets too. Persisted.
+    """
+    def __init__(self, filename='channel_mutations.json'):
+        self.filename = filename
+        self.stats = load_data(filename) or {"edits": 0, "saved": 0, "lifecycles": 0, "lifecycle_saved": 0, "open": {}}
+
+    def record(self, channel_id, saved):
+        self.stats["edits"] += 1
+        self.stats["saved"] += saved
+        key = str(channel_id)
+        self.stats["open"][key] = self.stats["open"].get(key, 0) + saved
+        self._persist()
+
+    def finish(self, channel_id):
+        """The channel is gone: its count becomes one finished lifecycle."""
+        saved = self.stats["open"].pop(str(channel_id), None)
+        if saved is None:
+            return
+        self.stats["lifecycles"] += 1
+        self.stats["lifecycle_saved"] += saved
+        self._persist()
+
+    def summary(self):
+        stats = self.stats
+        text = f"Channel edits: {stats['edits']} batched, {stats['saved']} REST calls saved"
+        if stats["lifecycles"]:
+            text += f" ({stats['lifecycle_saved'] / stats['lifecycles']:.1f} per ticket over {stats['lifecycles']} finished)"
+        return text
+
+    def _persist(self):
+        save_data(self.filename, self.stats)
+
+channel_mutations = ChannelMutationStats()
+
 class TicketButton(discord.ui.View):
     def __init__(self, guild_id):
         super().__init__()
@@ -139,33 +2294,43 @@ class TicketAdminView(discord.ui.View):
     @discord.ui.button(label="� Reopen Ticket", style=discord.ButtonStyle.green, custom_id="reopen_ticket_btn")
     async def reopen_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer()
-        
-        # Get Tickets Category
         guild = interaction.guild
-        category = discord.utils.get(guild.categories, name="Tickets")
-        if not category:
-            category = await guild.create_category("Tickets")
-            
-        await interaction.channel.edit(category=category)
-        
+
         # Restore user permissions
         # We need to find the user from the channel name or topic, but easier:
         # Just restore permissions for the specific user found in overwrites
-        for target, overwrite in interaction.channel.overwrites.items():
-            if isinstance(target, discord.Member) and target != guild.me:
-                # Use view_channel for d.py 2.0+
-                await interaction.channel.set_permissions(target, view_channel=True, send_messages=True, read_message_history=True)
-                
-                # Try to rename, but don't fail if rate limited
-                try:
-                    await interaction.channel.edit(name=f"ticket-{target.name}")
-                except Exception as e:
-                    print(f"[WARNING] Could not rename channel on reopen: {e}")
-                    
-                await interaction.channel.send(f"🔓 Ticket reopened! Welcome back {target.mention}")
-                return
-        
-        await interaction.followup.send("✅ Ticket reopened (User not found in overwrites)", ephemeral=True)
+        target = next((t for t in interaction.channel.overwrites if isinstance(t, discord.Member) and t != guild.me), None)
+
+        if target is not None:
+            # One open ticket per user: don't reopen over the ticket they opened since
+            existing_id = open_tickets.get(guild.id, target.id)
+            if existing_id is not None and existing_id != interaction.channel.id:
+                existing = guild.get_channel(existing_id)
+                if existing is not None:
+                    await interaction.followup.send(f"❌ {target.mention} already has a ticket open: {existing.mention}. Close it before reopening this one.", ephemeral=True)
+                    return
+                open_tickets.close_channel(existing_id)
+
+        # Get Tickets Category
+        category = await category_allocator.allocate(guild, "Tickets", private=False)
+        mutation = ChannelMutation(interaction.channel).move(category)
+
+        if target is not None:
+            # Use view_channel for d.py 2.0+
+            mutation.set_permissions(target, view_channel=True, send_messages=True, read_message_history=True)
+            # Queued after the edit, applied as soon as the rename budget allows
+            mutation.rename(f"ticket-{target.name}")
+
+        # Category and permissions in one edit
+        await mutation.apply()
+
+        if target is None:
+            await interaction.followup.send("✅ Ticket reopened (User not found in overwrites)", ephemeral=True)
+            return
+
+        open_tickets.open(guild.id, target.id, interaction.channel.id)
+        ticket_store.update(interaction.channel.id, closed_at=None)
+        await interaction.channel.send(f"🔓 Ticket reopened! Welcome back {target.mention}")
 
     @discord.ui.button(label="⛔ Delete Ticket", style=discord.ButtonStyle.red, custom_id="delete_ticket_btn")
     async def delete_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -173,19 +2338,24 @@ class TicketAdminView(discord.ui.View):
         await asyncio.sleep(5)
         await interaction.channel.delete()
 
-    @discord.ui.button(label="📝 Force Rename", style=discord.ButtonStyle.secondary, custom_id="force_rename_btn", emoji="📝")
-    async def force_rename(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # Admin tool to retry renaming if rate limited
+    @discord.ui.button(label="🗄️ Archive", style=discord.ButtonStyle.secondary, custom_id="archive_ticket_btn")
+    async def archive_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_message("🗄️ Archiving ticket transcript, the channel will be deleted when done...", ephemeral=True)
         try:
-             # Sanitize owner name query
-             new_name = f"closedorder-{interaction.channel.name.split('-')[-1]}"
-             # Try to find original owner from embed if possible, but channel name suffix is safest fallback
-             
-             await interaction.response.defer()
-             await interaction.channel.edit(name=new_name)
-             await interaction.followup.send(f"✅ Renamed to {new_name}", ephemeral=True)
+            await transcript_archiver.archive(interaction.channel, closed_by=interaction.user)
         except Exception as e:
-             await interaction.followup.send(f"❌ Failed to rename: {e}\n(Discord limits renames to 2 per 10 mins. Try again later.)", ephemeral=True)
+            print(f"[ERROR] Archiving ticket: {e}")
+            await interaction.followup.send(f"❌ Archive failed: {e}", ephemeral=True)
+
+    @discord.ui.button(label="📝 Force Rename", style=discord.ButtonStyle.secondary, custom_id="force_rename_btn", emoji="📝")
+    async def force_rename(self, interaction: discord.Interaction, button: discord.ui.Button):
+        # Admin tool to re-apply the closed name, goes through the rename queue like every rename
+        new_name = rename_queue.pending_name(interaction.channel.id) or f"closedorder-{interaction.channel.name.split('-')[-1]}"
+        run_at = rename_queue.request(interaction.channel, new_name)
+        if run_at <= time.time():
+            await interaction.response.send_message(f"✅ Renaming to {new_name}", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"⏳ Discord limits renames to 2 per 10 mins, {new_name} will be applied <t:{int(run_at)}:R>.", ephemeral=True)
 
 class TicketCloseConfirmationView(discord.ui.View):
     def __init__(self):
@@ -199,89 +2369,61 @@ class TicketCloseConfirmationView(discord.ui.View):
         channel = interaction.channel
         guild = interaction.guild
         
-        # 0. Extract Info (Owner & Order) before closing
-        ticket_owner = "Unknown"
-        order_info = "General Support / No Order Found"
-        
-        # Try to find owner from channel name or permissions
-        # Best guess: Find the user who has view permissions and isn't a bot/admin
-        # OR scan chat for the welcome message mention
-        
-        # Scan chat for Order Embed to get valid info
-        try:
-            async for msg in channel.history(limit=50, oldest_first=True):
-                # Check for Welcome Mention for owner
-                if not ticket_owner or ticket_owner == "Unknown":
-                    if msg.mentions and not msg.author.bot:
-                         # First human mention might be owner? No, bot mentions user in welcome.
-                         pass
-                
-                # Check for Bot's Embeds
-                if msg.author.id == interaction.client.user.id and msg.embeds:
-                    embed = msg.embeds[0]
-                    # Check for Order
-                    if "Order" in (embed.title or ""):
-                        for field in embed.fields:
-                            if field.name in ["🛒 Item", "📦 Service"]:
-                                order_info = field.value
-                        # Also get author if available
-                        if embed.author:
-                            ticket_owner = embed.author.name
-                    
-                    # Check for Welcome to grab owner if not found yet
-                    if "Welcome" in (embed.title or "") and "Ticket" not in (embed.title or ""):
-                         # "👋 Welcome username!"
-                         if "Welcome" in embed.title:
-                             ticket_owner = embed.title.replace("👋 Welcome ", "").replace("!", "")
-
-        except:
-             pass
+        # 0. Owner & Order come from the ticket metadata (no history reads)
+        ticket = ticket_store.get(channel.id)
+        order_info = ticket_order_info(ticket)
+        ticket_owner = ticket["owner_name"] if ticket else "Unknown"
+        if not ticket:
+            # Ticket opened before metadata was recorded: owner from the cached overwrites
+            for target in channel.overwrites:
+                if isinstance(target, discord.Member) and not target.bot:
+                    ticket_owner = target.name
+                    break
 
         try:
             try:
                 await interaction.message.delete()
             except:
                 pass
-            
-            # Get Logs Category with Rolling Logic (Ticket Logs -> Ticket Logs1 -> Ticket Logs2 ...)
-            log_category_names = ["Ticket Logs", "Ticket Logs1", "Ticket Logs2", "Ticket Logs3", "Ticket Logs4", "Ticket Logs5", "Ticket Logs6", "Ticket Logs7", "Ticket Logs8", "Ticket Logs9", "Ticket Logs10", "Ticket Logs11", "Ticket Logs12", "Ticket Logs13", "Ticket Logs14", "Ticket Logs15"]
-            target_category = None
 
-            for cat_name in log_category_names:
-                category = discord.utils.get(guild.categories, name=cat_name)
-                
-                if category:
-                    # Check if full (50 channels max)
-                    if len(category.channels) < 50:
-                        target_category = category
-                        break
-                else:
-                    # Category doesn't exist, create it and use it
-                    overwrites = {
-                        guild.default_role: discord.PermissionOverwrite(view_channel=False)
-                    }
-                    target_category = await guild.create_category(cat_name, overwrites=overwrites)
-                    break
+            if ARCHIVE_ON_CLOSE:
+                # Transcript to the log channel, ticket channel deleted
+                open_tickets.close_channel(channel.id)
+                ticket_store.update(channel.id, closed_at=int(time.time()))
+                await transcript_archiver.archive(channel, closed_by=interaction.user)
+                return
             
-            # Fallback if all are full (use the last one or default)
-            if not target_category:
-                target_category = discord.utils.get(guild.categories, name="Ticket Logs15")
-                if not target_category:
-                     # Should have been created in loop, but just in case
-                     overwrites = {
-                        guild.default_role: discord.PermissionOverwrite(view_channel=False)
-                    }
-                     target_category = await guild.create_category("Ticket Logs15", overwrites=overwrites)
+            # Logs Category with room left (Ticket Logs -> Ticket Logs1 -> Ticket Logs2 ...)
+            target_category = await category_allocator.allocate(guild, "Ticket Logs")
 
             # Step 1: Move category (Critical)
-            await channel.edit(category=target_category)
+            mutation = ChannelMutation(channel).move(target_category)
             
             # Step 2: Remove permissions (Security)
-            for target, overwrite in channel.overwrites.items():
+            for target in channel.overwrites:
                 if isinstance(target, discord.Member) and target != guild.me:
-                    await channel.set_permissions(target, view_channel=False, send_messages=False, read_message_history=False)
+                    mutation.set_permissions(target, view_channel=False, send_messages=False, read_message_history=False)
+
+            # Step 3: Rename Channel (Cosmetic - Low Priority)
+            # Queued after the move + permissions edit, so a rename rate limit can't delay closing
+            # Sanitize owner name (remove spaces/special chars)
+            safe_owner = "unknown"
+            if ticket_owner and ticket_owner != "Unknown":
+                safe_owner = "".join(c for c in ticket_owner if c.isalnum()).lower()
+            else:
+                # Fallback to channel name suffix
+                safe_owner = channel.name.split('-')[-1]
+
+            # "closedorder" stuck together as requested + Date
+            date_str = datetime.now().strftime("%d%m") # DayMonth e.g. 1302
+            mutation.rename(f"closedorder-{safe_owner}-{date_str}")
 
-            # Step 3: Send Enhanced Embed (Controls + Info)
+            # One channel.edit instead of one call per change
+            await mutation.apply()
+            open_tickets.close_channel(channel.id)
+            ticket_store.update(channel.id, closed_at=int(time.time()))
+
+            # Step 4: Send Enhanced Embed (Controls + Info)
             embed = discord.Embed(
                 title="🔒 **Ticket Closed**",
                 color=0xFF0000,
@@ -294,24 +2436,6 @@ class TicketCloseConfirmationView(discord.ui.View):
             
             await channel.send(embed=embed, view=TicketAdminView())
             
-            # Step 4: Rename Channel (Cosmetic - Low Priority)
-            # We put this last so if it fails (rate limit), the ticket is still closed and usable by admins
-            try:
-                # Sanitize owner name (remove spaces/special chars)
-                safe_owner = "unknown"
-                if ticket_owner and ticket_owner != "Unknown":
-                    safe_owner = "".join(c for c in ticket_owner if c.isalnum()).lower()
-                else:
-                    # Fallback to channel name suffix
-                    safe_owner = channel.name.split('-')[-1]
-                
-                # "closedorder" stuck together as requested + Date
-                date_str = datetime.now().strftime("%d%m") # DayMonth e.g. 1302
-                new_name = f"closedorder-{safe_owner}-{date_str}"
-                await channel.edit(name=new_name[:100])
-            except Exception as e:
-                print(f"[WARNING] Rename failed (Rate Limit?): {e}")
-            
         except Exception as e:
             print(f"[ERROR] processing ticket close: {e}")
             import traceback
@@ -350,15 +2474,12 @@ class OrderModal(discord.ui.Modal):
         self.add_item(self.notes)
 
     async def on_submit(self, interaction: discord.Interaction):
-        # Update the ticket name to reflect the order (optional)
-        try:
-            # Normalize service name for channel name
-            safe_service = self.service_name.lower().replace(' ', '-').replace('/', '-').replace('v-bucks', 'vbucks')
-            new_name = f"order-{safe_service}-{interaction.user.name}"
-            # Truncate to 100 chars just in case
-            await interaction.channel.edit(name=new_name[:100])
-        except:
-            pass # Ignore rename errors
+        ticket_store.update(interaction.channel.id, service=self.service_name, package=f"{self.service_name} x {self.quantity.value}")
+
+        # Update the ticket name to reflect the order (optional, queued behind the rename budget)
+        # Normalize service name for channel name
+        safe_service = self.service_name.lower().replace(' ', '-').replace('/', '-').replace('v-bucks', 'vbucks')
+        rename_queue.request(interaction.channel, f"order-{safe_service}-{interaction.user.name}")
 
         embed = discord.Embed(
             title="📝 **New Order Request**",
@@ -378,42 +2499,26 @@ class OrderModal(discord.ui.Modal):
         await interaction.channel.send(f"{interaction.user.mention} Thank you! Support will be with you shortly.")
 
 async def process_package_order(interaction: discord.Interaction, item_str, payment_method, notes=None):
+    ticket_store.update(interaction.channel.id, package=item_str, payment_method=payment_method)
+
+    # Rename channel to order
+    safe_item = item_str.split(':')[0].lower().replace(' ', '-').replace('v-bucks', 'vbucks')
+    mutation = ChannelMutation(interaction.channel).rename(f"order-{safe_item}-{interaction.user.name}")
+
     try:
-        # Rename channel to order
-        safe_item = item_str.split(':')[0].lower().replace(' ', '-').replace('v-bucks', 'vbucks')
-        await interaction.channel.edit(name=f"order-{safe_item}-{interaction.user.name}"[:100])
-        
-        # Move to Category
-        guild = interaction.guild
-        category_name = "Orders" # Default
-        
-        if "Gifting" in item_str:
-            category_name = "Gifting Orders"
-        elif "VP" in item_str or "Valorant" in item_str:
-            category_name = "Valorant Orders"
-        elif "Nitro" in item_str:
-            category_name = "Nitro Orders"
-        elif "V-Bucks" in item_str:
-            category_name = "Fortnite Orders"
-            
-        category = discord.utils.get(guild.categories, name=category_name)
-        if not category:
-            overwrites = {
-                guild.default_role: discord.PermissionOverwrite(view_channel=False)
-            }
-            category = await guild.create_category(category_name, overwrites=overwrites)
-        
-        await interaction.channel.edit(category=category)
-        
+        # Move to Category (overflows into "<name>1", "<name>2", ... when full)
+        mutation.move(await category_allocator.allocate(interaction.guild, order_category_name(item_str)))
     except Exception as e:
-        print(f"Error moving/renaming: {e}")
-        pass
+        print(f"Error finding order category: {e}")
 
     # Enable writing for user after order
+    mutation.set_permissions(interaction.user, view_channel=True, send_messages=True, read_message_history=True)
+
     try:
-        await interaction.channel.set_permissions(interaction.user, view_channel=True, send_messages=True, read_message_history=True)
+        # Category and permissions in one edit, the new name is queued right after
+        await mutation.apply()
     except Exception as e:
-        print(f"Error setting permissions after order: {e}")
+        print(f"Error moving/renaming: {e}")
 
     embed = discord.Embed(title="📝 **Order Confirmed**", color=0x2ECC71, timestamp=datetime.now())
     embed.add_field(name="🛒 Item", value=f"**{item_str}**", inline=False)
@@ -502,42 +2607,26 @@ class PackageOrderModal(discord.ui.Modal):
         self.add_item(self.notes)
 
     async def on_submit(self, interaction: discord.Interaction):
+        ticket_store.update(interaction.channel.id, package=self.item_str, payment_method=self.payment_method)
+
+        # Rename channel to order
+        safe_item = self.item_str.split(':')[0].lower().replace(' ', '-').replace('v-bucks', 'vbucks')
+        mutation = ChannelMutation(interaction.channel).rename(f"order-{safe_item}-{interaction.user.name}")
+
         try:
-             # Rename channel to order
-            safe_item = self.item_str.split(':')[0].lower().replace(' ', '-').replace('v-bucks', 'vbucks')
-            await interaction.channel.edit(name=f"order-{safe_item}-{interaction.user.name}"[:100])
-            
-            # Move to Category
-            guild = interaction.guild
-            category_name = "Orders" # Default
-            
-            if "Gifting" in self.item_str:
-                category_name = "Gifting Orders"
-            elif "VP" in self.item_str or "Valorant" in self.item_str:
-                category_name = "Valorant Orders"
-            elif "Nitro" in self.item_str:
-                category_name = "Nitro Orders"
-            elif "V-Bucks" in self.item_str:
-                category_name = "Fortnite Orders"
-                
-            category = discord.utils.get(guild.categories, name=category_name)
-            if not category:
-                overwrites = {
-                    guild.default_role: discord.PermissionOverwrite(view_channel=False)
-                }
-                category = await guild.create_category(category_name, overwrites=overwrites)
-            
-            await interaction.channel.edit(category=category)
-            
+            # Move to Category (overflows into "<name>1", "<name>2", ... when full)
+            mutation.move(await category_allocator.allocate(interaction.guild, order_category_name(self.item_str)))
         except Exception as e:
-            print(f"Error moving/renaming: {e}")
-            pass
+            print(f"Error finding order category: {e}")
 
         # Enable writing for user after order
+        mutation.set_permissions(interaction.user, view_channel=True, send_messages=True, read_message_history=True)
+
         try:
-            await interaction.channel.set_permissions(interaction.user, view_channel=True, send_messages=True, read_message_history=True)
+            # Category and permissions in one edit, the new name is queued right after
+            await mutation.apply()
         except Exception as e:
-            print(f"Error setting permissions after order: {e}")
+            print(f"Error moving/renaming: {e}")
 
         embed = discord.Embed(title="📝 **Order Confirmed**", color=0x2ECC71, timestamp=datetime.now())
         embed.add_field(name="🛒 Item", value=f"**{self.item_str}**", inline=False)
@@ -612,6 +2701,7 @@ class ServiceSelect(discord.ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         service = self.values[0]
+        ticket_store.update(interaction.channel.id, service=next(option.label for option in self.options if option.value == service))
 
         # Disable the dropdown to prevent changing selection
         self.disabled = True
@@ -672,15 +2762,9 @@ class ServiceSelect(discord.ui.Select):
             embed.set_footer(text="Karys Shop | Valorant Gifting Service")
             
             try:
-                # Move to Gifting Orders Category if exists
-                guild = interaction.guild
-                category = discord.utils.get(guild.categories, name="Gifting Orders")
-                if not category:
-                     overwrites = {
-                        guild.default_role: discord.PermissionOverwrite(view_channel=False)
-                     }
-                     category = await guild.create_category("Gifting Orders", overwrites=overwrites)
-                await interaction.channel.edit(category=category)
+                # Move to Gifting Orders Category
+                category = await category_allocator.allocate(interaction.guild, "Gifting Orders")
+                await ChannelMutation(interaction.channel).move(category).apply()
             except:
                 pass
                 
@@ -757,31 +2841,25 @@ class ServiceSelect(discord.ui.Select):
 
         else:
             # "Other" - No Modal, just prompt user to speak in chat
+            # Enable writing for user
+            mutation = ChannelMutation(interaction.channel).set_permissions(interaction.user, view_channel=True, send_messages=True, read_message_history=True)
             try:
                 # Move to Support Category
-                guild = interaction.guild
-                category = discord.utils.get(guild.categories, name="Support Tickets")
-                if not category:
-                    overwrites = {
-                        guild.default_role: discord.PermissionOverwrite(view_channel=False)
-                    }
-                    category = await guild.create_category("Support Tickets", overwrites=overwrites)
-                
-                await interaction.channel.edit(category=category)
+                mutation.move(await category_allocator.allocate(interaction.guild, "Support Tickets"))
             except:
                 pass
+
+            # Category and permissions in one edit
+            try:
+                await mutation.apply()
+            except Exception as e:
+                print(f"Error setting permissions for Other: {e}")
             
             embed = discord.Embed(
                 title="❓ **Other / Support**",
                 description="Please describe your Request / Issue directly in this chat.\nSupport will be with you shortly!",
                 color=0x95A5A6
             )
-            
-            # Enable writing for user
-            try:
-                await interaction.channel.set_permissions(interaction.user, view_channel=True, send_messages=True, read_message_history=True)
-            except Exception as e:
-                print(f"Error setting permissions for Other: {e}")
 
             await interaction.response.send_message(embed=embed)
 
@@ -794,33 +2872,231 @@ class ServiceView(discord.ui.View):
     async def close_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.send_message("Are you sure you would like to close this ticket?", view=TicketCloseConfirmationView(), ephemeral=False)
 
-async def auto_close_empty_ticket(channel: discord.TextChannel, user: discord.Member, delay_seconds: int = 600):
-    """Wait for a specified time, if the user hasn't sent any message in the channel, delete it."""
-    await asyncio.sleep(delay_seconds)
-    
-    try:
-        current_channel = channel.guild.get_channel(channel.id)
-        if current_channel is None:
-            return # Channel already deleted
-            
-        # Verify if user has sent any message (excluding interactions/bots)
-        # We check the last 50 messages to be safe.
-        messages = [msg async for msg in current_channel.history(limit=50)]
-        user_messaged = any(msg.author.id == user.id and msg.content.strip() != "" for msg in messages)
-        
-        if not user_messaged:
+# --- Ticket Activity ---
+TICKET_IDLE_SECONDS = 600 # Tickets whose owner hasn't typed anything are deleted after this long
+TICKET_SWEEP_INTERVAL = 30 # Seconds between two sweeps
+
+class TicketActivity:
+    """Ticket channel -> owner, auto-close deadline and last human message, fed by on_message.
+
+    One sweeper task deletes the tickets whose owner didn't write anything before the deadline,
+    straight from this table (no history reads). Persisted, so deadlines survive restarts.
+    """
+    def __init__(self, filename='ticket_activity.json'):
+        self.filename = filename
+        self.tickets = load_data(filename) # "channel_id" -> {"guild_id", "owner_id", "deadline", "last_message", "owner_messaged", "human_messaged"}
+        self.task = None
+        self.closed = 0
+
+    def track(self, channel, owner, idle_seconds=TICKET_IDLE_SECONDS):
+        self.tickets[str(channel.id)] = {
+            "guild_id": channel.guild.id,
+            "owner_id": owner.id,
+            "deadline": int(time.time()) + idle_seconds,
+            "last_message": None,
+            "owner_messaged": False,
+            "human_messaged": False
+        }
+        self._persist()
+
+    def record_message(self, message):
+        entry = self.tickets.get(str(message.channel.id))
+        if entry is None or message.author.bot:
+            return
+        entry["last_message"] = int(time.time())
+        if message.content.strip() != "":
+            entry["human_messaged"] = True
+            if message.author.id == entry["owner_id"]:
+                entry["owner_messaged"] = True
+        self._persist()
+
+    def has_human_messages(self, channel_id):
+        """True/False if the table knows whether anyone typed in the ticket, None if it has to be read."""
+        entry = self.tickets.get(str(channel_id))
+        if entry is None:
+            return None
+        if entry["owner_messaged"] or entry.get("human_messaged"):
+            return True
+        # Entries tracked before "human_messaged" existed only know about the owner
+        return False if "human_messaged" in entry else None
+
+    def forget(self, channel_id):
+        if self.tickets.pop(str(channel_id), None) is not None:
+            self._persist()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Error auto-closing empty ticket: {e}")
+            await asyncio.sleep(TICKET_SWEEP_INTERVAL)
+
+    async def sweep(self):
+        now = time.time()
+        for channel_id, entry in list(self.tickets.items()):
+            if entry["owner_messaged"] or entry["deadline"] > now:
+                continue
+            guild = bot.get_guild(entry["guild_id"])
+            channel = guild.get_channel(int(channel_id)) if guild else None
+            if channel is None:
+                # Channel already deleted
+                self.forget(channel_id)
+                continue
+
             # Delete completely, even if it was moved to orders or logs
-            await current_channel.delete(reason="Auto-closed empty ticket due to inactivity.")
+            self.forget(channel_id)
+            try:
+                await channel.delete(reason="Auto-closed empty ticket due to inactivity.")
+            except discord.NotFound:
+                continue
+            self.closed += 1
             try:
+                user = guild.get_member(entry["owner_id"]) or await bot.fetch_user(entry["owner_id"])
                 await user.send(
-                    f"⏰ **تم إغلاق التذكرة الخاصة بك في {channel.guild.name} تلقائياً.**\n"
+                    f"⏰ **تم إغلاق التذكرة الخاصة بك في {guild.name} تلقائياً.**\n"
                     f"السبب: لم تقم بكتابة أي رسالة داخل التذكرة لمدة 10 دقائق.\n\n"
                     f"*(Your ticket was automatically deleted due to 10 minutes of inactivity.)*"
                 )
             except:
                 pass
-    except Exception as e:
-        print(f"Error auto-closing empty ticket: {e}")
+
+    def _persist(self):
+        save_data(self.filename, self.tickets)
+
+ticket_activity = TicketActivity()
+
+@bot.listen('on_message')
+async def track_ticket_activity(message):
+    # O(1) lookup, messages outside tracked tickets are ignored
+    ticket_activity.record_message(message)
+
+# --- Ticket Channel Pool ---
+TICKET_POOL_SIZE = int(os.getenv("TICKET_POOL_SIZE", "0")) # Default pre-created ticket channels per guild (0 = off)
+TICKET_POOL_REFILL_SPACING = 5.0 # Seconds between two channel creations while refilling
+TICKET_POOL_CATEGORY = "Ticket Pool"
+
+class TicketChannelPool:
+    """Hidden ticket channels created ahead of time, so opening a ticket is one edit, not a create.
+
+    claim() hands out a pooled channel, or None when the guild's pool is empty and the caller
+    creates one on demand. One background task per guild tops the pool back up, a channel every
+    TICKET_POOL_REFILL_SPACING seconds. The size is set per guild with !ticket_pool.
+    """
+    def __init__(self, filename='ticket_pool.json'):
+        self.filename = filename
+        self.guilds = load_data(filename) # "guild_id" -> {"size": int or None (default), "channels": [channel ids]}
+        self.refilling = {} # guild_id -> refill task
+        self.claimed = 0
+        self.misses = 0
+
+    def _entry(self, guild_id):
+        return self.guilds.setdefault(str(guild_id), {"size": None, "channels": []})
+
+    def size(self, guild_id):
+        entry = self.guilds.get(str(guild_id))
+        if entry is None or entry["size"] is None:
+            return TICKET_POOL_SIZE
+        return entry["size"]
+
+    def available(self, guild_id):
+        entry = self.guilds.get(str(guild_id))
+        return len(entry["channels"]) if entry else 0
+
+    def set_size(self, guild, size):
+        self._entry(guild.id)["size"] = size
+        self._persist()
+        self.refill(guild)
+
+    def claim(self, guild):
+        entry = self.guilds.get(str(guild.id))
+        channel = None
+        while entry and entry["channels"] and channel is None:
+            # Skip channels deleted while pooled
+            channel = guild.get_channel(entry["channels"].pop(0))
+        if entry:
+            self._persist()
+        if channel is not None:
+            self.claimed += 1
+        elif self.size(guild.id) > 0:
+            self.misses += 1
+        self.refill(guild)
+        return channel
+
+    def forget(self, channel_id):
+        for entry in self.guilds.values():
+            if channel_id in entry["channels"]:
+                entry["channels"].remove(channel_id)
+                self._persist()
+                return
+
+    def discard(self, channel):
+        """Delete a claimed channel that couldn't be turned into a ticket, in the background."""
+        self.forget(channel.id)
+
+        async def delete():
+            try:
+                await channel.delete(reason="Pooled ticket channel could not be claimed")
+            except discord.NotFound:
+                pass
+            except Exception as e:
+                print(f"[TICKETS] Could not delete pooled channel {channel.name}: {e}")
+
+        asyncio.get_running_loop().create_task(delete())
+
+    def refill(self, guild):
+        if self.size(guild.id) <= 0 and not self.available(guild.id):
+            return
+        task = self.refilling.get(guild.id)
+        if task is None or task.done():
+            self.refilling[guild.id] = asyncio.get_running_loop().create_task(self._refill(guild))
+
+    async def _refill(self, guild):
+        entry = self._entry(guild.id)
+        while True:
+            entry["channels"] = [cid for cid in entry["channels"] if guild.get_channel(cid) is not None]
+            size = self.size(guild.id)
+            try:
+                if len(entry["channels"]) < size:
+                    channel = await self._create(guild)
+                    entry["channels"].append(channel.id)
+                elif len(entry["channels"]) > size:
+                    # Pool made smaller
+                    channel = guild.get_channel(entry["channels"].pop())
+                    await channel.delete(reason="Ticket pool shrunk")
+                else:
+                    self._persist()
+                    return
+            except discord.NotFound:
+                pass
+            except Exception as e:
+                # Tried again on the next claim
+                print(f"[TICKETS] Ticket pool refill failed in {guild.name}: {e}")
+                self._persist()
+                return
+            self._persist()
+            await asyncio.sleep(TICKET_POOL_REFILL_SPACING)
+
+    async def _create(self, guild):
+        category = await category_allocator.allocate(guild, TICKET_POOL_CATEGORY)
+        overwrites = {
+            guild.default_role: discord.PermissionOverwrite(view_channel=False),
+            guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True)
+        }
+        return await guild.create_text_channel("ticket-pool", category=category, overwrites=overwrites, reason="Pre-created ticket channel")
+
+    def summary(self):
+        pooled = sum(len(entry["channels"]) for entry in self.guilds.values())
+        return f"Ticket pool: {pooled} ready, {self.claimed} claimed, {self.misses} created on demand"
+
+    def _persist(self):
+        save_data(self.filename, self.guilds)
+
+ticket_pool = TicketChannelPool()
 
 class TicketSystemView(discord.ui.View):
     def __init__(self):
@@ -831,25 +3107,52 @@ class TicketSystemView(discord.ui.View):
         await interaction.response.defer(ephemeral=True)
         
         guild = interaction.guild
-        category = discord.utils.get(guild.categories, name="Tickets")
-        
-        if not category:
-            category = await guild.create_category("Tickets")
-            
-        # Check if user already has a ticket in this category (Active)
-        for channel in category.text_channels:
-            if interaction.user in channel.overwrites:
-                if channel.overwrites[interaction.user].view_channel:
-                     await interaction.followup.send(f"❌ You already have a ticket open: {channel.mention}", ephemeral=True)
-                     return
 
-        overwrites = {
-            guild.default_role: discord.PermissionOverwrite(view_channel=False),
-            interaction.user: discord.PermissionOverwrite(view_channel=True, send_messages=False, read_message_history=True),
-            guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True)
-        }
+        # Check if user already has a ticket open (index lookup, see OpenTicketIndex)
+        existing_id = open_tickets.get(guild.id, interaction.user.id)
+        if existing_id is not None:
+            existing = guild.get_channel(existing_id)
+            if existing is not None:
+                await interaction.followup.send(f"❌ You already have a ticket open: {existing.mention}", ephemeral=True)
+                return
+            # Deleted while we weren't looking
+            open_tickets.close_channel(existing_id)
+
+        # Claimed before the next await so a double click can't create two channels
+        if not open_tickets.reserve(guild.id, interaction.user.id):
+            await interaction.followup.send("⏳ Your ticket is already being created...", ephemeral=True)
+            return
+
+        try:
+            category = await category_allocator.allocate(guild, "Tickets", private=False)
+
+            overwrites = {
+                guild.default_role: discord.PermissionOverwrite(view_channel=False),
+                interaction.user: discord.PermissionOverwrite(view_channel=True, send_messages=False, read_message_history=True),
+                guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, read_message_history=True)
+            }
 
-        channel = await guild.create_text_channel(f"ticket-{interaction.user.name}", category=category, overwrites=overwrites)
+            channel = ticket_pool.claim(guild)
+            if channel is not None:
+                # Pre-created hidden channel: category and the user's access in one edit, then the rename
+                mutation = ChannelMutation(channel).rename(f"ticket-{interaction.user.name}").move(category)
+                mutation.set_permissions(interaction.user, view_channel=True, send_messages=False, read_message_history=True)
+                try:
+                    await mutation.apply()
+                except discord.NotFound:
+                    channel = None
+                except discord.HTTPException as e:
+                    # Unusable pooled channel: drop it (the refill replaces it) and create one instead
+                    print(f"[TICKETS] Claiming pooled channel {channel.name} failed: {e}")
+                    ticket_pool.discard(channel)
+                    channel = None
+            if channel is None:
+                # Pool empty (or off): create it on demand
+                channel = await guild.create_text_channel(f"ticket-{interaction.user.name}", category=category, overwrites=overwrites)
+            open_tickets.open(guild.id, interaction.user.id, channel.id)
+            ticket_store.create(channel, interaction.user)
+        finally:
+            open_tickets.release(guild.id, interaction.user.id)
         
         embed = discord.Embed(
             title=f"👋 Welcome {interaction.user.name}!",
@@ -866,13 +3169,36 @@ class TicketSystemView(discord.ui.View):
             inline=False
         )
         
+        # The user gets the link first, the welcome follows
+        await interaction.followup.send(f"✅ Ticket created: {channel.mention}", ephemeral=True)
+
         # Send ServiceView which has the Dropdown AND Close button
         await channel.send(f"{interaction.user.mention}", embed=embed, view=ServiceView())
         
-        await interaction.followup.send(f"✅ Ticket created: {channel.mention}", ephemeral=True)
-        
-        # Start the auto-close timer (600 seconds = 10 minutes)
-        bot.loop.create_task(auto_close_empty_ticket(channel, interaction.user, 600))
+        # Auto-close deadline (10 minutes), checked by the activity sweeper
+        ticket_activity.track(channel, interaction.user, TICKET_IDLE_SECONDS)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    # Covers every way a ticket disappears (delete button, auto-close, manual delete)
+    open_tickets.close_channel(channel.id)
+    ticket_store.remove(channel.id)
+    ticket_activity.forget(channel.id)
+    rename_queue.forget(channel.id)
+    channel_mutations.finish(channel.id)
+    ticket_pool.forget(channel.id)
+    category_allocator.channel_deleted(channel)
+
+@bot.event
+async def on_guild_channel_create(channel):
+    category_allocator.channel_created(channel)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    category_allocator.channel_updated(before, after)
+    # A ticket moved to an order / support / logs category no longer blocks a new ticket
+    if after.category_id != before.category_id and (after.category is None or category_family(after.category.name)[0] not in OPEN_TICKET_CATEGORIES):
+        open_tickets.close_channel(after.id)
 
 # Flag to ensure on_ready logic only runs once
 bot_setup_done = False
@@ -895,37 +3221,48 @@ async def on_ready():
     bot.add_view(ServiceView())
     bot.add_view(TicketAdminView())
     bot.add_view(TicketCloseConfirmationView())
-    
 
-    
-    # Reload active giveaways
-    for giveaway_id, data in giveaways_data.items():
-        if not data["ended"]:
-            bot.add_view(GiveawayJoinButton(giveaway_id, data["required_invites"]))
-            
-            # Resume timer
-            try:
-                end_time_ts = data.get("end_time")
-                if end_time_ts:
-                    now_ts = datetime.now().timestamp()
-                    remaining = end_time_ts - now_ts
-                    
-                    if remaining <= 0:
-                        # Ended while offline
-                        bot.loop.create_task(end_giveaway_logic(giveaway_id))
-                    else:
-                        # Resume timer
-                        bot.loop.create_task(schedule_giveaway_end(giveaway_id, remaining))
-            except Exception as e:
-                print(f"Error resuming giveaway {giveaway_id}: {e}")
+    # Rebuild the open ticket index from the channel cache (tickets opened/deleted while offline)
+    for guild in bot.guilds:
+        open_tickets.reconcile(guild)
+
+    # One sweeper auto-closes every empty ticket (deadlines persisted across restarts)
+    ticket_activity.start()
+
+    # Top up the pre-created ticket channels (guilds with a pool only)
+    for guild in bot.guilds:
+        ticket_pool.refill(guild)
+
+    # Transcripts written while the search index wasn't updated
+    bot.loop.create_task(asyncio.to_thread(transcript_index.index_missing))
+    
+    # One instance serves every giveaway message (shared custom_id, the giveaway is looked up from the message)
+    bot.add_view(GiveawayJoinButton(None, 0))
+
+    # Data saved before per-guild partitioning is moved into the guild shards once
+    migrate_legacy_guild_data()
+
+    # Active giveaways are known from the persisted timers, no guild data is loaded here
+    overdue_giveaways = []
+    now_ts = time.time()
+    for job_id, job in list(scheduler.jobs.items()):
+        if job["kind"] == "giveaway_end" and job["run_at"] <= now_ts:
+            # Ended while offline: finalized by the catch-up runner, not all at once. The job stays
+            # (pushed back) until the giveaway is marked ended, so a crash meanwhile loses nothing
+            scheduler.reschedule(job_id, now_ts + CATCH_UP_LEASE)
+            overdue_giveaways.append((job["payload"].get("guild_id"), job["payload"]["message_id"]))
+
+    # One task runs every timer
+    scheduler.start()
+    rename_queue.resume()
+    print(f"⏰ Scheduler started with {scheduler.pending_count} pending job(s)")
+    if overdue_giveaways:
+        bot.loop.create_task(catch_up_overdue_giveaways(overdue_giveaways))
             
-    # Initialize invite cache - DISABLED TO PREVENT CLOUDFLARE 1015 ERROR
-    # for guild in bot.guilds:
-    #     try:
-    #         invite_cache[guild.id] = await guild.invites()
-    #         await asyncio.sleep(2) # Increased safety delay
-    #     except Exception as e:
-    #         print(f"Failed to fetch invites: {e}")
+    # Initialize invite cache in the background, paced to avoid 429 / Cloudflare 1015 bans
+    for guild in bot.guilds:
+        invite_warmup.enqueue(guild.id)
+    invite_warmup.start()
             
     bot_setup_done = True
     
@@ -1126,6 +3463,7 @@ async def help_shop(ctx):
     # Slash Commands
     embed.add_field(name="──────────────", value="**Slash Commands (Recommended):**", inline=False)
     embed.add_field(name="/kgiveaway", value="Create and Manage Giveaways (Admin)", inline=False)
+    embed.add_field(name="/leaderboard", value="Top inviters and your rank", inline=False)
     embed.add_field(name="/vbucks", value="View Fortnite V-Bucks prices", inline=False)
     embed.add_field(name="/ticket_panel", value="Deploy Ticket System (Admin)", inline=False)
     
@@ -1884,37 +4222,219 @@ async def payment(ctx):
     else:
         await ctx.send(embed=embed, view=view)
 
-@bot.command(name='clean_logs')
-@commands.has_permissions(administrator=True)
-async def clean_logs(ctx):
-    """Clean empty tickets from all Ticket Logs categories"""
-    message = await ctx.send("⏳ Scanning all `Ticket Logs` categories for empty tickets...\n*This might take a minute to avoid Discord rate limits.*")
-    deleted = 0
-    
-    # Check all Ticket Logs categories (up to 15)
-    for i in range(16):
-        cat_name = "Ticket Logs" if i == 0 else f"Ticket Logs{i}"
-        category = discord.utils.get(ctx.guild.categories, name=cat_name)
-        
-        if category:
-            for channel in category.text_channels:
+# --- Bulk Jobs ---
+BULK_START_CONCURRENCY = 4
+BULK_MAX_CONCURRENCY = 8
+BULK_PROGRESS_INTERVAL = 5.0 # Seconds between two progress message edits
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+class BulkJob:
+    """Runs `work(item)` for every item through a pool of workers sized by Discord's rate limits.
+
+    The pool starts at BULK_START_CONCURRENCY, grows by one after a run of clean requests and
+    halves whenever one of `routes` gets a 429. Before each item the workers wait out whatever
+    pause the response headers asked for. `work` returns an outcome name that is counted.
+    """
+    def __init__(self, items, work, routes, concurrency=BULK_START_CONCURRENCY, max_concurrency=BULK_MAX_CONCURRENCY):
+        self.items = deque(items)
+        self.total = len(self.items)
+        self.work = work
+        self.routes = routes
+        self.limit = min(concurrency, max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.streak = 0
+        self.seen_hits = rate_limits.hits_for(routes)
+        self.done = 0
+        self.failed = 0
+        self.outcomes = {}
+        self.started = None
+        self.slots = asyncio.Condition()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started else 0
+
+    @property
+    def rate(self):
+        return self.done / self.elapsed if self.elapsed > 0 else 0
+
+    @property
+    def eta(self):
+        return (self.total - self.done) / self.rate if self.rate > 0 else None
+
+    def status(self):
+        eta = format_duration(self.eta) if self.eta is not None else "..."
+        return f"**{self.done}/{self.total}** • {self.rate:.1f}/s • ETA {eta} • {self.limit} at a time"
+
+    async def _acquire(self):
+        async with self.slots:
+            await self.slots.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def _release(self, finished=True):
+        async with self.slots:
+            self.active -= 1
+            if not finished:
+                self.slots.notify_all()
+                return
+            hits = rate_limits.hits_for(self.routes)
+            if hits > self.seen_hits:
+                # Discord pushed back: halve the pool
+                self.seen_hits = hits
+                self.limit = max(1, self.limit // 2)
+                self.streak = 0
+            else:
+                self.streak += 1
+                if self.streak >= self.limit * 2 and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.streak = 0
+            self.slots.notify_all()
+
+    async def _worker(self):
+        while self.items:
+            await self._acquire()
+            if not self.items:
+                await self._release(finished=False)
+                return
+            item = self.items.popleft()
+            try:
+                await rate_limits.wait(self.routes)
+                outcome = await self.work(item)
+            except discord.NotFound:
+                outcome = "gone"
+            except Exception as e:
+                print(f"[BULK] Failed on {item}: {e}")
+                outcome = None
+                self.failed += 1
+            if outcome:
+                self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.done += 1
+            await self._release()
+
+    async def run(self, progress=None):
+        """Process every item; `progress(job)` is awaited every BULK_PROGRESS_INTERVAL seconds."""
+        self.started = time.monotonic()
+        workers = asyncio.gather(*(self._worker() for _ in range(min(self.max_concurrency, self.total))))
+        while True:
+            done, _ = await asyncio.wait({workers}, timeout=BULK_PROGRESS_INTERVAL)
+            if done:
+                break
+            if progress:
                 try:
-                    # Check the last 50 messages in the channel
-                    messages = [msg async for msg in channel.history(limit=50)]
-                    # Check if any non-bot user sent a message containing text
-                    user_messaged = any(not msg.author.bot and msg.content.strip() != "" for msg in messages)
-                    
-                    if not user_messaged:
-                        await channel.delete(reason="Admin cleanup of empty tickets.")
-                        deleted += 1
-                        # Crucial wait to avoid discord API rate limits when deleting many channels
-                        await asyncio.sleep(1.5)
-                except discord.NotFound:
-                    pass
+                    await progress(self)
                 except Exception as e:
-                    print(f"Error checking/deleting {channel.name}: {e}")
-                    
-    await message.edit(content=f"✅ **Cleanup complete!** Deleted **{deleted}** empty tickets from the logs.")
+                    print(f"[BULK] Progress update failed: {e}")
+        await workers
+        return self
+
+async def has_human_messages(channel):
+    """Whether a non-bot user typed in the channel, from the activity table or 50 messages of history."""
+    known = ticket_activity.has_human_messages(channel.id)
+    if known is not None:
+        return known
+    async for msg in channel.history(limit=50):
+        if not msg.author.bot and msg.content.strip() != "":
+            return True
+    return False
+
+@bot.command(name='clean_logs')
+@commands.has_permissions(administrator=True)
+async def clean_logs(ctx, mode: str = None):
+    """Clean empty tickets from all Ticket Logs categories (`!clean_logs dry` only counts them)"""
+    dry_run = mode is not None and mode.lower() in ("dry", "dry-run", "dryrun", "preview")
+    channels = [
+        channel
+        for category in ctx.guild.categories if category_family(category.name)[0] == "Ticket Logs"
+        for channel in category.text_channels
+    ]
+    label = "Dry run: counting" if dry_run else "Cleaning"
+    message = await ctx.send(f"⏳ {label} empty tickets in **{len(channels)}** `Ticket Logs` channels...")
+
+    async def clean(channel):
+        if await has_human_messages(channel):
+            return "kept"
+        if dry_run:
+            return "empty"
+        await channel.delete(reason="Admin cleanup of empty tickets.")
+        return "deleted"
+
+    async def progress(job):
+        await message.edit(content=f"⏳ {label} empty tickets in `Ticket Logs`... {job.status()}")
+
+    job = BulkJob(channels, clean, routes=("GET /channels/{id}/messages", "DELETE /channels/{id}"))
+    await job.run(progress)
+
+    outcomes = job.outcomes
+    if dry_run:
+        text = f"🔍 **Dry run complete!** **{outcomes.get('empty', 0)}** empty tickets would be deleted from the logs"
+    else:
+        text = f"✅ **Cleanup complete!** Deleted **{outcomes.get('deleted', 0)}** empty tickets from the logs"
+    text += f" ({outcomes.get('kept', 0)} kept, {format_duration(job.elapsed)}, {job.rate:.1f} channels/s)."
+    if job.failed:
+        text += f"\n⚠️ {job.failed} failed, see the console."
+    await message.edit(content=text)
+
+@bot.command(name='archive_logs')
+@commands.has_permissions(administrator=True)
+async def archive_logs(ctx):
+    """Archive every ticket left in the Ticket Logs categories to transcripts"""
+    message = await ctx.send("⏳ Archiving `Ticket Logs` channels to transcripts...")
+    last_edit = 0
+
+    async def progress(done, total):
+        nonlocal last_edit
+        # Progress edits at most every 5 seconds
+        if time.monotonic() - last_edit >= 5 and done < total:
+            last_edit = time.monotonic()
+            await message.edit(content=f"⏳ Archiving `Ticket Logs` channels... **{done}/{total}**")
+
+    archived, failed = await transcript_archiver.backfill(ctx.guild, progress)
+    text = f"✅ **Archive complete!** Archived **{archived}** tickets to {TRANSCRIPT_CHANNEL}."
+    if failed:
+        text += f"\n⚠️ {failed} failed, see the console."
+    await message.edit(content=text)
+
+@bot.tree.command(name="ticket_search", description="Search archived ticket transcripts (Admin Only)")
+@discord.app_commands.describe(
+    query="Words to look for (message text, package, payment method, owner...)",
+    user="Only tickets opened by this user (Optional)",
+    page="Page number (Optional)"
+)
+async def ticket_search(interaction: discord.Interaction, query: str, user: discord.Member = None, page: int = 1):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Admin only.", ephemeral=True)
+        return
+
+    started = time.perf_counter()
+    page = max(page, 1)
+    try:
+        total, rows = transcript_index.search(interaction.guild_id, query, user.id if user else None, page - 1)
+    except sqlite3.OperationalError as e:
+        await interaction.response.send_message(f"❌ Invalid search: {e}", ephemeral=True)
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    pages = max(1, math.ceil(total / TRANSCRIPT_SEARCH_PAGE_SIZE))
+    embed = discord.Embed(title=f"🔎 Transcripts: {query}"[:256], color=0x3498DB)
+    for row in rows:
+        closed = f"<t:{row['closed_at']}:d>" if row["closed_at"] else "?"
+        owner = f"<@{row['owner_id']}>" if row["owner_id"] else (row["owner_name"] or "Unknown")
+        order = " • ".join(value for value in (row["package"] or row["service"], row["payment_method"]) if value)
+        value = f"👤 {owner} • 📅 {closed}" + (f"\n📝 {order}" if order else "") + f"\n> {' '.join(row['excerpt'].split())}"
+        embed.add_field(name=f"#{row['channel_name']} ({row['message_count']} messages)", value=value[:1024], inline=False)
+    if not rows:
+        embed.description = "No transcript matches."
+    embed.set_footer(text=f"Page {min(page, pages)}/{pages} • {total} result(s) in {elapsed_ms:.1f} ms")
+
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
 
@@ -2334,6 +4854,19 @@ async def ticket_panel(ctx):
             print(f"[ERROR] Failed to send image: {e}")
             await ctx.send(embed=embed, view=TicketSystemView())
 
+@bot.command(name='ticket_pool')
+@commands.has_permissions(administrator=True)
+async def ticket_pool_command(ctx, size: int = None):
+    """Show or set how many ticket channels are pre-created for this server"""
+    if size is None:
+        await ctx.send(f"🎟️ Ticket pool: **{ticket_pool.available(ctx.guild.id)}/{ticket_pool.size(ctx.guild.id)}** channels ready.\nUse `!ticket_pool <size>` to change it (0 = off).")
+        return
+    if size < 0 or size > CATEGORY_CHANNEL_LIMIT:
+        await ctx.send(f"❌ The pool size must be between 0 and {CATEGORY_CHANNEL_LIMIT}.")
+        return
+    ticket_pool.set_size(ctx.guild, size)
+    await ctx.send(f"✅ Ticket pool set to **{size}** channels, refilling in the background.")
+
 @bot.tree.command(name="ticket_panel", description="Deploy the ticket panel (Admin Only)")
 async def ticket_panel_slash(interaction: discord.Interaction):
     """Slash command to deploy ticket panel"""
@@ -2395,6 +4928,13 @@ async def sync(ctx):
     else:
         await ctx.send("❌ You do not have permission to use this command.")
 
+@bot.command(name="save_stats")
+@commands.has_permissions(administrator=True)
+async def save_stats(ctx):
+    """Show how many data writes were coalesced"""
+    pending = ", ".join(data_saver.dirty.keys()) or "None"
+    await ctx.send(f"💾 {data_saver.summary()}\n⏳ Pending: {pending}\n🎉 {entry_updater.summary()}\n🗂️ Guilds loaded: {len(guild_shards)}/{len(bot.guilds)}\n✏️ {rename_queue.summary()}\n🔧 {channel_mutations.summary()}\n🎟️ {ticket_pool.summary()}")
+
 @bot.command(name="giveaway")
 async def giveaway_prefix(ctx):
     await ctx.send("⚠️ **Please use the new slash commands:**\n`/gcreate` - Start a new giveaway\n`/gend` - End a giveaway\n`/glist` - List active giveaways")
@@ -2406,35 +4946,71 @@ async def invites_prefix(ctx):
 # --- Giveaway Commands ---
 
 @bot.tree.command(name="invites", description="Check your invites or another user's")
+@discord.app_commands.guild_only()
 async def invites(interaction: discord.Interaction, member: discord.Member = None):
     target = member or interaction.user
     user_id = str(target.id)
+    shard = get_shard(interaction.guild_id)
     
-    if user_id not in invites_data:
-        invites_data[user_id] = {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}
+    if user_id not in shard.invites:
+        shard.invites[user_id] = {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}
         
-    data = invites_data[user_id]
+    data = shard.invites[user_id]
     total = (data["regular"] + data["bonus"]) - (data["leaves"] + data["fake"])
     if total < 0: total = 0
     
     embed = discord.Embed(title=f"✉️ Invites for {target.name}", color=0x3498DB)
     embed.add_field(name="Total Valid", value=f"**{total}**", inline=False)
     embed.add_field(name="Details", value=f"✅ Regular: {data['regular']}\n🎁 Bonus: {data['bonus']}\n🚪 Left: {data['leaves']}\n❌ Fake: {data['fake']}", inline=False)
+    embed.add_field(
+        name="📅 Recent",
+        value=" | ".join(f"{days}d: **{get_windowed_invites(interaction.guild_id, user_id, days)}**" for days in WindowedCounter.WINDOWS),
+        inline=False
+    )
     
     await interaction.response.send_message(embed=embed)
 
+LEADERBOARD_PAGE_SIZE = 10
+
+@bot.tree.command(name="leaderboard", description="Top inviters")
+@discord.app_commands.describe(page="Page number (Optional)")
+@discord.app_commands.guild_only()
+async def leaderboard(interaction: discord.Interaction, page: int = 1):
+    invite_leaderboard = get_shard(interaction.guild_id).leaderboard
+    total_ranked = len(invite_leaderboard)
+    pages = max(1, math.ceil(total_ranked / LEADERBOARD_PAGE_SIZE))
+    page = max(1, min(page, pages))
+    offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = []
+    for position, (user_id, total) in enumerate(invite_leaderboard.top(LEADERBOARD_PAGE_SIZE, offset), start=offset + 1):
+        lines.append(f"{medals.get(position, f'`#{position}`')} <@{user_id}> • **{total}** invites")
+
+    embed = discord.Embed(title="🏆 Invite Leaderboard", description="\n".join(lines) or "No invites yet.", color=0xF1C40F)
+    my_rank = invite_leaderboard.rank(interaction.user.id)
+    if my_rank:
+        embed.add_field(name="📍 Your Rank", value=f"**#{my_rank}** of {total_ranked} • **{get_invites(interaction.guild_id, interaction.user.id)}** invites", inline=False)
+    else:
+        embed.add_field(name="📍 Your Rank", value="Unranked (no valid invites yet)", inline=False)
+    embed.set_footer(text=f"Page {page}/{pages}")
+
+    await interaction.response.send_message(embed=embed)
+
 # --- Giveaway Commands (Top-Level) ---
 
 @bot.tree.command(name="gcreate", description="Start a new giveaway")
+@discord.app_commands.guild_only()
 @discord.app_commands.describe(
     prize="Prize description",
     winners="Number of winners",
     duration="Duration (e.g. 1m, 1h, 1d)",
     channel="Channel to host the giveaway in (Optional)",
     required_invites="Invites required to join (Optional)",
+    invite_window_days="Only count invites from the last N days (Optional, default: all time)",
     description="Extra description (Optional)"
 )
-async def gcreate(interaction: discord.Interaction, prize: str, winners: int, duration: str, channel: discord.TextChannel = None, required_invites: int = 0, description: str = None):
+async def gcreate(interaction: discord.Interaction, prize: str, winners: int, duration: str, channel: discord.TextChannel = None, required_invites: int = 0, invite_window_days: Literal[1, 7, 30] = None, description: str = None):
     # Parse duration
     time_units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
     try:
@@ -2467,7 +5043,7 @@ async def gcreate(interaction: discord.Interaction, prize: str, winners: int, du
         embed.add_field(name="🏆 Winners", value=f"{winners}", inline=True)
     
     if required_invites > 0:
-        embed.add_field(name="📨 Required Invites", value=f"{required_invites}", inline=True)
+        embed.add_field(name="📨 Required Invites", value=format_required_invites(required_invites, invite_window_days), inline=True)
         
     embed.add_field(name="👥 Entries", value="0", inline=True)
     
@@ -2478,24 +5054,28 @@ async def gcreate(interaction: discord.Interaction, prize: str, winners: int, du
     message = await target_channel.send(embed=embed)
     
     # Save giveaway
-    giveaways_data[str(message.id)] = {
+    shard = get_shard(interaction.guild.id)
+    shard.giveaways[str(message.id)] = {
+        "guild_id": interaction.guild.id,
         "channel_id": target_channel.id,
         "prize": prize,
         "winners": winners,
         "required_invites": required_invites,
+        "invite_window_days": invite_window_days or 0,
         "end_time": timestamp,
-        "participants": [],
+        "participants": ParticipantSet(),
         "ended": False
     }
-    save_data('giveaways.json', giveaways_data)
+    shard.persist_giveaway(message.id)
     
     # Add View
     await message.edit(view=GiveawayJoinButton(str(message.id), required_invites))
     
-    # Background task to end giveaway
-    bot.loop.create_task(schedule_giveaway_end(message.id, seconds))
+    # Scheduler ends the giveaway at end_time
+    schedule_giveaway_end(interaction.guild.id, message.id, timestamp)
 
 @bot.tree.command(name="gend", description="End a running giveaway immediately")
+@discord.app_commands.guild_only()
 @discord.app_commands.describe(message_id="Message ID of the giveaway")
 async def gend(interaction: discord.Interaction, message_id: str):
     if not message_id:
@@ -2503,18 +5083,26 @@ async def gend(interaction: discord.Interaction, message_id: str):
         return
     
     # Check if giveaway exists
-    if message_id not in giveaways_data:
+    giveaways = get_shard(interaction.guild_id).giveaways
+    if message_id not in giveaways:
             await interaction.response.send_message("❌ Giveaway not found.", ephemeral=True)
             return
 
-    if giveaways_data[message_id]["ended"]:
+    if giveaways[message_id]["ended"]:
             await interaction.response.send_message("❌ This giveaway has already ended.", ephemeral=True)
             return
 
     await interaction.response.send_message("✅ Ending giveaway...", ephemeral=True)
-    await end_giveaway_logic(message_id)
+    # The timer job is removed once it's ended
+    try:
+        await end_giveaway_logic(interaction.guild_id, message_id)
+    except Exception:
+        # Retried by the scheduler instead of waiting for the original end time
+        schedule_giveaway_end(interaction.guild_id, message_id, time.time() + JOB_RETRY_BASE)
+        await interaction.followup.send(f"⚠️ Couldn't end the giveaway right now, retrying in {JOB_RETRY_BASE}s.", ephemeral=True)
 
 @bot.tree.command(name="greroll", description="Pick new winners for a giveaway")
+@discord.app_commands.guild_only()
 @discord.app_commands.describe(message_id="Message ID of the giveaway", winners="Number of new winners (Optional)")
 async def greroll(interaction: discord.Interaction, message_id: str, winners: int = 1):
     if not message_id:
@@ -2524,164 +5112,323 @@ async def greroll(interaction: discord.Interaction, message_id: str, winners: in
     await reroll_giveaway(interaction, message_id, winners)
 
 @bot.tree.command(name="glist", description="List active giveaways")
+@discord.app_commands.guild_only()
 async def glist(interaction: discord.Interaction):
-    active_giveaways = [gid for gid, data in giveaways_data.items() if not data["ended"]]
+    if storage:
+        # Indexed query instead of scanning every giveaway ever created
+        active_giveaways = storage.active_giveaways(interaction.guild_id)
+    else:
+        active_giveaways = [
+            (gid, data) for gid, data in get_shard(interaction.guild_id).giveaways.items()
+            if not data["ended"]
+        ]
     if not active_giveaways:
         await interaction.response.send_message("No active giveaways.", ephemeral=True)
         return
         
     msg = "**Active Giveaways:**\n"
-    for gid in active_giveaways:
-        data = giveaways_data[gid]
+    for gid, data in active_giveaways:
         channel = interaction.guild.get_channel(data["channel_id"])
         channel_mention = channel.mention if channel else "Unknown Channel"
         msg += f"- 🆔 `{gid}` | 🎁 **{data['prize']}** | 📍 {channel_mention} | ⏳ <t:{data['end_time']}:R>\n"
+    msg += f"\n⏰ Scheduler: {scheduler.pending_count} pending job(s)"
     
     await interaction.response.send_message(msg, ephemeral=True)
 
+# --- Participants Pages & Export ---
+PARTICIPANTS_PER_PAGE = 50
+
+def write_participants_export(guild_id, giveaway_id, fmt):
+    """Stream a giveaway's participants to a temp file row by row. Returns the file path."""
+    participants = get_shard(guild_id).giveaways[giveaway_id]["participants"]
+    fd, path = tempfile.mkstemp(prefix=f"participants-{giveaway_id}-", suffix=f".{fmt}")
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(["position", "user_id", "entries"])
+            for position, uid in enumerate(participants, start=1):
+                writer.writerow([position, uid, get_entry_weight(guild_id, uid)])
+        else:
+            for position, uid in enumerate(participants, start=1):
+                f.write(json.dumps({"position": position, "user_id": uid, "entries": get_entry_weight(guild_id, uid)}))
+                f.write("\n")
+    return path
+
+class ParticipantsPaginator(discord.ui.View):
+    def __init__(self, guild_id, giveaway_id, page=0):
+        super().__init__(timeout=600)
+        self.guild_id = guild_id
+        self.giveaway_id = giveaway_id
+        self.page = page
+
+    @property
+    def participants(self):
+        return get_shard(self.guild_id).giveaways[self.giveaway_id]["participants"]
+
+    def page_count(self):
+        return max(1, math.ceil(len(self.participants) / PARTICIPANTS_PER_PAGE))
+
+    def render(self):
+        participants = self.participants
+        pages = self.page_count()
+        self.page = max(0, min(self.page, pages - 1))
+        start = self.page * PARTICIPANTS_PER_PAGE
+        lines = [f"`{start + i + 1}.` <@{uid}>" for i, uid in enumerate(participants.page(start, start + PARTICIPANTS_PER_PAGE))]
+
+        embed = discord.Embed(title=f"👥 Participants ({len(participants)})", description="\n".join(lines) or "No participants.", color=0x00FF00)
+        embed.set_footer(text=f"Page {self.page + 1}/{pages} • Giveaway {self.giveaway_id}")
+
+        self.first_page.disabled = self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.last_page.disabled = self.page >= pages - 1
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("❌ Admin only.", ephemeral=True)
+            return False
+        if self.giveaway_id not in get_shard(self.guild_id).giveaways:
+            await interaction.response.send_message("❌ Giveaway not found.", ephemeral=True)
+            return False
+        return True
+
+    async def show_page(self, interaction, page):
+        self.page = page
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(emoji="⏮️", style=discord.ButtonStyle.secondary, row=0)
+    async def first_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, 0)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary, row=0)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page - 1)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary, row=0)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page + 1)
+
+    @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.secondary, row=0)
+    async def last_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page_count() - 1)
+
+    async def send_export(self, interaction, fmt):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        path = None
+        try:
+            # Written off the event loop, one row at a time
+            path = await asyncio.to_thread(write_participants_export, self.guild_id, self.giveaway_id, fmt)
+            file = discord.File(path, filename=f"participants-{self.giveaway_id}.{fmt}")
+            await interaction.followup.send(f"📄 {len(self.participants)} participants", file=file, ephemeral=True)
+        except Exception as e:
+            print(f"[ERROR] Participants export failed: {e}")
+            await interaction.followup.send(f"❌ Export failed: {e}", ephemeral=True)
+        finally:
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @discord.ui.button(label="CSV", emoji="📄", style=discord.ButtonStyle.primary, row=1)
+    async def export_csv(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.send_export(interaction, "csv")
+
+    @discord.ui.button(label="JSONL", emoji="📄", style=discord.ButtonStyle.primary, row=1)
+    async def export_jsonl(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.send_export(interaction, "jsonl")
+
 @bot.tree.command(name="gparticipants", description="Show giveaway participants (Admin Only)")
+@discord.app_commands.guild_only()
 @discord.app_commands.describe(message_id="Message ID of the giveaway")
 async def gparticipants(interaction: discord.Interaction, message_id: str):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
 
-    if message_id not in giveaways_data:
+    giveaways = get_shard(interaction.guild_id).giveaways
+    if message_id not in giveaways:
             await interaction.response.send_message("❌ Giveaway not found.", ephemeral=True)
             return
             
-    participants = giveaways_data[message_id]["participants"]
+    participants = giveaways[message_id]["participants"]
     if not participants:
         await interaction.response.send_message("❌ No participants yet.", ephemeral=True)
         return
 
-    count = len(participants)
-    user_list = ", ".join([f"<@{uid}>" for uid in participants[:80]]) # Limit to avoid 2000 char limit
-    
-    embed = discord.Embed(title=f"👥 Participants ({count})", description=user_list, color=0x00FF00)
-    if count > 80:
-        embed.set_footer(text=f"And {count-80} more...")
-        
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    # Pages are rendered on demand, the full list can be downloaded as CSV / JSONL
+    view = ParticipantsPaginator(interaction.guild_id, message_id)
+    await interaction.response.send_message(embed=view.render(), view=view, ephemeral=True)
 
 @bot.tree.command(name="gchance", description="Add bonus chances to a user (Admin Only)")
+@discord.app_commands.guild_only()
 @discord.app_commands.describe(user="User to manage", amount="Amount to add")
 async def gchance(interaction: discord.Interaction, user: discord.Member, amount: int):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ Admin only.", ephemeral=True)
         return
 
-    user_id = str(user.id)
-    if user_id not in invites_data:
-        invites_data[user_id] = {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}
-    
-    invites_data[user_id]["bonus"] += amount
-    save_data('invites.json', invites_data)
+    total_bonus = bump_invite_counter(interaction.guild_id, user.id, "bonus", amount)
 
-    await interaction.response.send_message(f"✅ Added **{amount}** bonus chances to {user.mention}. Total Bonus: {invites_data[user_id]['bonus']}", ephemeral=True)
+    await interaction.response.send_message(f"✅ Added **{amount}** bonus chances to {user.mention}. Total Bonus: {total_bonus}", ephemeral=True)
 
-async def schedule_giveaway_end(message_id, delay):
-    await asyncio.sleep(delay)
-    await end_giveaway_logic(message_id)
+def giveaway_job_id(message_id):
+    return f"giveaway_end:{message_id}"
 
-async def end_giveaway_logic(message_id):
-    message_id = str(message_id)
-    if message_id not in giveaways_data or giveaways_data[message_id]["ended"]:
-        return
+def schedule_giveaway_end(guild_id, message_id, end_time_ts):
+    scheduler.schedule(giveaway_job_id(message_id), "giveaway_end", end_time_ts, {"guild_id": int(guild_id), "message_id": str(message_id)})
 
-    data = giveaways_data[message_id]
-    channel = bot.get_channel(data["channel_id"])
-    
-    if channel:
-        try:
-            message = await channel.fetch_message(int(message_id))
-            
-            # Select winners
-            participants = data["participants"]
-            winners_count = data["winners"]
-            
-            if not participants:
-                await message.reply("❌ **Giveaway Ended:** No one joined.")
-                data["ended"] = True
-                save_data('giveaways.json', giveaways_data)
-                return
+async def run_giveaway_end_job(payload):
+    # Raising keeps the job: the scheduler retries it with a backoff
+    if not await end_giveaway_logic(payload.get("guild_id"), payload["message_id"]):
+        raise RuntimeError("giveaway is being ended elsewhere, checking again later")
 
-            # Logic for chances: Simple pool expansion (User ID * Chance)
-            weighted_pool = []
-            for uid in participants:
-                # Base chance = 1
-                chance = 1
-                uid_str = str(uid)
-                if uid_str in invites_data:
-                    chance += invites_data[uid_str].get("bonus", 0)
-                
-                if chance < 1: chance = 1 
-                
-                # Add to pool
-                weighted_pool.extend([uid] * chance)
-            
-            winners = []
-            if len(participants) < winners_count:
-                winners = participants # Everyone wins
-            else:
-                 try:
-                     temp_pool = weighted_pool.copy()
-                     for _ in range(winners_count):
-                         if not temp_pool: break
-                         winner = random.choice(temp_pool)
-                         winners.append(winner)
-                         temp_pool = [x for x in temp_pool if x != winner]
-                 except:
-                     winners = [random.choice(participants)]
-
-            winners_mentions = ", ".join([f"<@{uid}>" for uid in winners])
-            
-            embed = message.embeds[0]
-            embed.color = 0x2ECC71
-            embed.title = "🎉 **GIVEAWAY ENDED** 🎉"
-            embed.description = f"**Prize:** {data['prize']}\n**Winners:** {winners_mentions}"
-            embed.set_footer(text="Ended")
-            
-            await message.edit(embed=embed, view=None) # Remove button
-            await message.reply(f"🎉 **Congratulations** {winners_mentions}! You won **{data['prize']}**!")
-            
+scheduler.register("giveaway_end", run_giveaway_end_job)
+
+def format_required_invites(required_invites, window_days=None):
+    if window_days:
+        return f"{required_invites} (last {window_days}d)"
+    return f"{required_invites}"
+
+def build_ended_giveaway_embed(data, winners):
+    """Render the ended giveaway embed from stored state (same layout as the /gcreate embed)."""
+    winners_mentions = ", ".join([f"<@{uid}>" for uid in winners])
+    embed = discord.Embed(
+        title="🎉 **GIVEAWAY ENDED** 🎉",
+        description=f"**Prize:** {data['prize']}\n**Winners:** {winners_mentions}",
+        color=0x2ECC71
+    )
+    if data["winners"] > 1:
+        embed.add_field(name="🏆 Winners", value=f"{data['winners']}", inline=True)
+    if data.get("required_invites", 0) > 0:
+        embed.add_field(name="📨 Required Invites", value=format_required_invites(data["required_invites"], data.get("invite_window_days")), inline=True)
+    embed.add_field(name="👥 Entries", value=str(len(data["participants"])), inline=True)
+    embed.set_footer(text="Ended")
+    embed.timestamp = datetime.fromtimestamp(data["end_time"])
+    return embed
+
+# Giveaways currently being finalized (stops /gend and the scheduler from ending one twice)
+ending_giveaways = set()
+
+async def end_giveaway_logic(guild_id, message_id):
+    """Finalize a giveaway. True once it is ended (or there's nothing to end), False if it is
+    being ended by another call right now. Discord errors are raised so callers can retry;
+    the giveaway's timer job is only removed once it's marked ended."""
+    message_id = str(message_id)
+    if guild_id is None:
+        # Timer from before per-guild storage that migrate_legacy_guild_data() couldn't place
+        print(f"[GIVEAWAY] Unknown guild for giveaway {message_id}, skipping.")
+        return True
+    shard = get_shard(guild_id)
+    if message_id in ending_giveaways:
+        return False
+    if message_id not in shard.giveaways or shard.giveaways[message_id]["ended"]:
+        scheduler.cancel(giveaway_job_id(message_id))
+        return True
+
+    data = shard.giveaways[message_id]
+    entry_updater.discard(message_id)
+    # Partial objects: edit/reply straight away without fetching the message (or channel) first
+    channel = bot.get_channel(data["channel_id"]) or bot.get_partial_messageable(data["channel_id"])
+    message = channel.get_partial_message(int(message_id))
+
+    ending_giveaways.add(message_id)
+    try:
+        # Select winners
+        participants = data["participants"]
+        winners_count = data["winners"]
+        
+        if not participants:
+            await message.reply("❌ **Giveaway Ended:** No one joined.")
             data["ended"] = True
-            data["winners_list"] = winners
-            save_data('giveaways.json', giveaways_data)
+            shard.persist_giveaway(message_id)
+            scheduler.cancel(giveaway_job_id(message_id))
+            return True
+
+        # Chances: 1 entry + bonus entries per user (weighted draw, no pool expansion)
+        winners = []
+        if data.get("winners_list"):
+            # A previous attempt drew them and then failed: announce the same winners
+            winners = data["winners_list"]
+        elif len(participants) < winners_count:
+            winners = participants.to_list() # Everyone wins
+        else:
+             try:
+                 winners = pick_giveaway_winners(guild_id, participants, winners_count)
+             except Exception as e:
+                 print(f"Error picking weighted winners: {e}")
+                 winners = [random.choice(participants)]
+
+        winners_mentions = ", ".join([f"<@{uid}>" for uid in winners])
+        # Kept before announcing, so a retry doesn't draw different winners
+        data["winners_list"] = winners
+        shard.persist_giveaway(message_id)
+        
+        await message.edit(embed=build_ended_giveaway_embed(data, winners), view=None) # Remove button
+        await message.reply(f"🎉 **Congratulations** {winners_mentions}! You won **{data['prize']}**!")
+        
+        data["ended"] = True
+        shard.persist_giveaway(message_id)
+        scheduler.cancel(giveaway_job_id(message_id))
+        return True
 
-        except Exception as e:
-            print(f"Error ending giveaway: {e}")
+    except Exception as e:
+        print(f"Error ending giveaway: {e}")
+        raise
+    finally:
+        ending_giveaways.discard(message_id)
+
+# How many overdue giveaways are finalized at the same time after a restart
+CATCH_UP_CONCURRENCY = 3
+# Overdue timers are pushed back this far while the catch-up runner works through them, so the
+# scheduler doesn't fire them all at once; if the bot dies meanwhile they're overdue again on restart
+CATCH_UP_LEASE = 3600
+
+async def catch_up_overdue_giveaways(giveaway_ids, concurrency=CATCH_UP_CONCURRENCY):
+    """Finalize giveaways that expired while the bot was offline, a few at a time.
+
+    giveaway_ids: (guild_id, message_id) pairs. Failures go back to the scheduler with a backoff.
+    """
+    queue = asyncio.Queue()
+    for giveaway_id in giveaway_ids:
+        queue.put_nowait(giveaway_id)
+    total = len(giveaway_ids)
+    done = 0
+    print(f"[GIVEAWAY] Catching up {total} giveaway(s) that ended while offline...")
+
+    async def worker():
+        nonlocal done
+        while not queue.empty():
+            guild_id, giveaway_id = queue.get_nowait()
+            try:
+                ended = await end_giveaway_logic(guild_id, giveaway_id)
+            except Exception as e:
+                print(f"[GIVEAWAY] Catch-up failed for {giveaway_id}: {e}, retrying in {JOB_RETRY_BASE}s")
+                ended = False
+            if not ended:
+                # Its timer (re)created with a short delay, the scheduler keeps retrying from there
+                schedule_giveaway_end(guild_id, giveaway_id, time.time() + JOB_RETRY_BASE)
+            done += 1
+            if done % 10 == 0 or done == total:
+                print(f"[GIVEAWAY] Catch-up progress: {done}/{total}")
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
 
 async def reroll_giveaway(interaction, message_id, winners_count):
     message_id = str(message_id)
-    if message_id not in giveaways_data:
+    giveaways = get_shard(interaction.guild_id).giveaways
+    if message_id not in giveaways:
         await interaction.response.send_message("❌ Giveaway not found.", ephemeral=True)
         return
 
-    data = giveaways_data[message_id]
+    data = giveaways[message_id]
     participants = data["participants"]
     
     if not participants:
         await interaction.response.send_message("❌ No participants to reroll.", ephemeral=True)
         return
 
-    # Weighted Logic again
-    weighted_pool = []
-    for uid in participants:
-        chance = 1
-        if uid in invites_data:
-            chance += invites_data[uid]["bonus"]
-        if chance < 1: chance = 1 
-        weighted_pool.extend([uid] * chance)
-    
-    winners = []
-    temp_pool = weighted_pool.copy()
-    
-    for _ in range(winners_count):
-        if not temp_pool: break
-        winner = random.choice(temp_pool)
-        winners.append(winner)
-        temp_pool = [x for x in temp_pool if x != winner]
+    # Same weighted draw as end_giveaway_logic
+    winners = pick_giveaway_winners(interaction.guild_id, participants, winners_count)
 
     winners_mentions = ", ".join([f"<@{uid}>" for uid in winners])
     await interaction.channel.send(f"🎉 **New Winner(s):** {winners_mentions}!")
@@ -2689,57 +5436,333 @@ async def reroll_giveaway(interaction, message_id, winners_count):
     await interaction.response.send_message("✅ Rerolled.", ephemeral=True)
 
 
+# --- Invite Tracking ---
+# Joins arriving within this many seconds share one guild.invites() fetch
+INVITE_JOIN_WINDOW = 2.0
+INVITE_JOIN_MAX_RETRIES = 5 # Failed fetches before a batch of joins is given up
+
+def snapshot_invites(invites):
+    """Invite list -> {code: {"uses", "max_uses", "inviter_id"}} (what invite_cache stores per guild)."""
+    return {
+        invite.code: {
+            "uses": invite.uses or 0,
+            "max_uses": invite.max_uses or 0,
+            "inviter_id": invite.inviter.id if invite.inviter else None
+        }
+        for invite in invites
+    }
+
+def diff_invite_uses(cached, current):
+    """Compare two snapshots by code. Returns one inviter_id per new use (O(invites), no nested loop)."""
+    inviter_ids = []
+    for code, info in current.items():
+        before = cached.get(code)
+        if before is not None and info["uses"] < before["uses"]:
+            # Uses never go down for the same code: stale cache entry, nothing to credit
+            continue
+        # A code we never saw was created after the snapshot, all its uses are new
+        delta = info["uses"] - (before["uses"] if before else 0)
+        if delta > 0 and info["inviter_id"]:
+            inviter_ids.extend([info["inviter_id"]] * delta)
+
+    # Limited invites are deleted by Discord on their last use, so they vanish from the list
+    for code, before in cached.items():
+        if code not in current and before["max_uses"] and before["uses"] + 1 == before["max_uses"] and before["inviter_id"]:
+            inviter_ids.append(before["inviter_id"])
+    return inviter_ids
+
+def credit_invite(member, inviter_id):
+    shard = get_shard(member.guild.id)
+    member_id = str(member.id)
+    if member_id in shard.member_inviters:
+        # Rejoin: the first inviter keeps the credit (see restore_rejoin), no second credit
+        return
+
+    # Check for fake (account age < 3 days?)
+    fake = (datetime.now(timezone.utc) - member.created_at).days < 3
+    bump_invite_counter(member.guild.id, inviter_id, "fake" if fake else "regular")
+
+    shard.member_inviters[member_id] = {"inviter_id": str(inviter_id), "fake": fake, "left": False}
+    shard.persist_member_inviter(member_id)
+
+def restore_rejoin(member):
+    """A tracked member came back: take back the leave their inviter was charged."""
+    shard = get_shard(member.guild.id)
+    member_id = str(member.id)
+    record = shard.member_inviters.get(member_id)
+    if record is None or not record["left"]:
+        return
+    record["left"] = False
+    if not record["fake"]:
+        bump_invite_counter(member.guild.id, record["inviter_id"], "leaves", -1)
+    shard.persist_member_inviter(member_id)
+
+class InviteJoinCoalescer:
+    """Groups joins per guild so a burst of joins costs one guild.invites() call and one diff."""
+    def __init__(self, window=INVITE_JOIN_WINDOW):
+        self.window = window
+        self.pending = {} # guild_id -> [members waiting for attribution]
+        self.tasks = {}
+        self.failures = {} # guild_id -> failed fetches in a row
+        self.joins = 0
+        self.fetches = 0
+
+    def add(self, member):
+        self.joins += 1
+        if not invite_warmup.is_warm(member.guild.id):
+            # No fresh baseline yet, attributed once the warm-up reaches this guild
+            invite_warmup.defer_join(member)
+            return
+        self.pending.setdefault(member.guild.id, []).append(member)
+        self._schedule(member.guild, self.window)
+
+    def take_pending(self, guild_id):
+        """Members waiting for the next fetch, for a fetch made elsewhere (drift refresh)."""
+        return self.pending.pop(guild_id, [])
+
+    def _schedule(self, guild, delay):
+        task = self.tasks.get(guild.id)
+        if task is None or task.done():
+            self.tasks[guild.id] = asyncio.get_running_loop().create_task(self._resolve_later(guild, delay))
+
+    async def _resolve_later(self, guild, delay):
+        await asyncio.sleep(delay)
+        # Joins from now on start a new batch
+        self.tasks.pop(guild.id, None)
+        members = self.pending.pop(guild.id, [])
+        if not members:
+            return
+
+        # Baseline taken before the fetch: a refresh landing meanwhile can't hide this batch's uses
+        cached = get_invite_snapshot(guild.id)
+        try:
+            self.fetches += 1
+            current = snapshot_invites(await guild.invites())
+        except Exception as e:
+            failures = self.failures.get(guild.id, 0) + 1
+            if isinstance(e, discord.Forbidden) or failures > INVITE_JOIN_MAX_RETRIES:
+                self.failures.pop(guild.id, None)
+                print(f"Error tracking invite: {e}, {len(members)} join(s) in {guild.name} not attributed")
+                return
+            # Back at the front of the queue, so the next fetch still pairs uses with joins in order
+            self.failures[guild.id] = failures
+            self.pending[guild.id] = members + self.pending.get(guild.id, [])
+            print(f"Error tracking invite: {e}, retrying")
+            self._schedule(guild, min(self.window * 2 ** failures, 60))
+            return
+
+        self.failures.pop(guild.id, None)
+        attribute_joins(guild, members, cached, current)
+
+def get_invite_snapshot(guild_id):
+    snapshot = invite_cache.get(guild_id)
+    if snapshot is None:
+        snapshot = invite_cache[guild_id] = load_data(guild_data_path(guild_id, 'invite_cache.json'))
+    return snapshot
+
+def set_invite_snapshot(guild_id, snapshot):
+    invite_cache[guild_id] = snapshot
+    os.makedirs(os.path.dirname(guild_data_path(guild_id, 'invite_cache.json')), exist_ok=True)
+    save_data(guild_data_path(guild_id, 'invite_cache.json'), snapshot)
+
+def attribute_joins(guild, members, cached, current):
+    """Credit inviters for members who joined between the cached and current snapshots."""
+    set_invite_snapshot(guild.id, current)
+    inviter_ids = diff_invite_uses(cached, current)
+
+    # Exact for a single join. For a batch, inviters get exactly the number of uses they
+    # gained; which of the batch's members is paired with which inviter is join order.
+    for member, inviter_id in zip(members, inviter_ids):
+        try:
+            credit_invite(member, inviter_id)
+        except Exception as e:
+            print(f"Error tracking invite: {e}")
+    if len(inviter_ids) < len(members):
+        print(f"[INVITES] {len(members) - len(inviter_ids)} join(s) in {guild.name} could not be attributed")
+
+invite_joins = InviteJoinCoalescer()
+
+# --- Invite Cache Warm-up ---
+INVITE_WARMUP_SPACING = 3.0 # Average seconds between two guild.invites() calls (jittered +/- 50%)
+INVITE_WARMUP_BUDGET = 15 # Max fetches per rolling minute
+INVITE_WARMUP_MAX_BACKOFF = 600
+
+class InviteCacheWarmup:
+    """Fetches every guild's invites once at startup through a paced queue.
+
+    A guild only leaves the queue once its fetch succeeded, so failed fetches are retried. The
+    queue lives in memory only: after a restart on_ready queues every guild again and warmup
+    starts over. Joins in a guild that isn't warmed yet are held back and attributed as soon as
+    its invites are fetched (diffed against the snapshot persisted before the restart).
+    """
+    def __init__(self):
+        self.queue = deque()
+        self.queued = set()
+        self.warmed = set()
+        self.deferred = {} # guild_id -> [members who joined before the guild was warmed]
+        self.fetch_times = deque()
+        self.backoff = 0
+        self.task = None
+
+    def is_warm(self, guild_id):
+        return guild_id in self.warmed
+
+    def enqueue(self, guild_id, priority=False):
+        if guild_id in self.warmed or guild_id in self.queued:
+            if priority and guild_id in self.queued and self.queue and self.queue[0] != guild_id:
+                self.queue.remove(guild_id)
+                self.queue.appendleft(guild_id)
+            return
+        self.queued.add(guild_id)
+        if priority:
+            self.queue.appendleft(guild_id)
+        else:
+            self.queue.append(guild_id)
+
+    def refresh(self, guild_id):
+        """Re-fetch a guild's invites (cache drift) through the same paced queue."""
+        if guild_id not in self.queued:
+            self.queued.add(guild_id)
+            self.queue.append(guild_id)
+        self.start()
+
+    def defer_join(self, member):
+        self.deferred.setdefault(member.guild.id, []).append(member)
+        # A guild with waiting joins jumps the queue
+        self.enqueue(member.guild.id, priority=True)
+        self.start()
+
+    def start(self):
+        if self.queue and (self.task is None or self.task.done()):
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _pace(self):
+        # Jittered spacing between calls
+        if self.fetch_times:
+            wait = self.fetch_times[-1] + INVITE_WARMUP_SPACING * random.uniform(0.5, 1.5) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        # Rolling one minute budget
+        while True:
+            now = time.monotonic()
+            while self.fetch_times and now - self.fetch_times[0] > 60:
+                self.fetch_times.popleft()
+            if len(self.fetch_times) < INVITE_WARMUP_BUDGET:
+                break
+            await asyncio.sleep(60 - (now - self.fetch_times[0]))
+        self.fetch_times.append(time.monotonic())
+
+    async def _run(self):
+        print(f"[INVITES] Warming invite cache for {len(self.queue)} guild(s)...")
+        while self.queue:
+            guild_id = self.queue[0]
+            guild = bot.get_guild(guild_id)
+            if guild is None:
+                self._done(guild_id)
+                continue
+
+            await self._pace()
+            try:
+                invites = await guild.invites()
+            except discord.Forbidden:
+                # Missing "Manage Server": invites can't be tracked here at all
+                print(f"[INVITES] No permission to read invites in {guild.name}, skipping.")
+                self.deferred.pop(guild_id, None)
+                self._done(guild_id)
+                continue
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    retry_after = float(e.response.headers.get("Retry-After", 0) or 0)
+                    self.backoff = min(max(self.backoff * 2, 5, retry_after), INVITE_WARMUP_MAX_BACKOFF)
+                else:
+                    self.backoff = min(max(self.backoff * 2, 5), INVITE_WARMUP_MAX_BACKOFF)
+                wait = self.backoff * random.uniform(1.0, 1.25)
+                print(f"[INVITES] Fetch failed for {guild.name} ({e.status}), retrying in {wait:.0f}s")
+                await asyncio.sleep(wait)
+                continue
+            except Exception as e:
+                self.backoff = min(max(self.backoff * 2, 5), INVITE_WARMUP_MAX_BACKOFF)
+                print(f"[INVITES] Fetch failed for {guild.name}: {e}, retrying in {self.backoff:.0f}s")
+                await asyncio.sleep(self.backoff)
+                continue
+
+            self.backoff = 0
+            current = snapshot_invites(invites)
+            # A drift refresh also serves the joins waiting for the coalescer's next fetch,
+            # otherwise their uses would already be in the baseline that batch diffs against
+            members = self.deferred.pop(guild_id, []) + invite_joins.take_pending(guild_id)
+            if members:
+                attribute_joins(guild, members, get_invite_snapshot(guild_id), current)
+            else:
+                set_invite_snapshot(guild_id, current)
+            self._done(guild_id)
+            self.warmed.add(guild_id)
+        print(f"[INVITES] Invite cache ready for {len(self.warmed)} guild(s).")
+
+    def _done(self, guild_id):
+        if self.queue and self.queue[0] == guild_id:
+            self.queue.popleft()
+        self.queued.discard(guild_id)
+
+invite_warmup = InviteCacheWarmup()
+
 # --- Invite Tracking Events ---
 
+@bot.event
+async def on_guild_join(guild):
+    invite_warmup.enqueue(guild.id)
+    invite_warmup.start()
+
 @bot.event
 async def on_invite_create(invite):
-    if invite.guild.id not in invite_cache:
-        invite_cache[invite.guild.id] = []
-    # Refresh cache for this guild
-    invite_cache[invite.guild.id] = await invite.guild.invites()
+    # Apply the event to the cache directly, no guild.invites() call
+    snapshot = get_invite_snapshot(invite.guild.id)
+    known = snapshot.get(invite.code)
+    if known is not None and not known.get("deleted"):
+        # We already had this code: the cache is out of sync with Discord
+        invite_warmup.refresh(invite.guild.id)
+    snapshot[invite.code] = {
+        "uses": invite.uses or 0,
+        "max_uses": invite.max_uses or 0,
+        "inviter_id": invite.inviter.id if invite.inviter else None
+    }
+    set_invite_snapshot(invite.guild.id, snapshot)
 
 @bot.event
 async def on_invite_delete(invite):
-    if invite.guild.id in invite_cache:
-        invite_cache[invite.guild.id] = await invite.guild.invites()
+    snapshot = get_invite_snapshot(invite.guild.id)
+    known = snapshot.get(invite.code)
+    if known is None or known.get("deleted"):
+        # Deleting a code we never saw: we missed an event somewhere
+        invite_warmup.refresh(invite.guild.id)
+        return
+    # Keep it as a tombstone: a limited invite is deleted on its last use, possibly before the
+    # join is processed, and diff_invite_uses() needs its last known uses to credit that join.
+    # The next full snapshot drops it.
+    known["deleted"] = True
+    set_invite_snapshot(invite.guild.id, snapshot)
 
 @bot.event
 async def on_member_join(member):
-    # Find inviter
-    inviter = None
-    try:
-        current_invites = await member.guild.invites()
-        cached_invites = invite_cache.get(member.guild.id, [])
-        
-        for invite in current_invites:
-            for cached in cached_invites:
-                if invite.code == cached.code and invite.uses > cached.uses:
-                    inviter = invite.inviter
-                    break
-            if inviter: break
-        
-        invite_cache[member.guild.id] = current_invites
-        
-        if inviter:
-            inviter_id = str(inviter.id)
-            if inviter_id not in invites_data:
-                invites_data[inviter_id] = {"regular": 0, "fake": 0, "bonus": 0, "leaves": 0}
-            
-            # Check for fake (account age < 3 days?)
-            if (datetime.now(timezone.utc) - member.created_at).days < 3:
-                invites_data[inviter_id]["fake"] += 1
-            else:
-                invites_data[inviter_id]["regular"] += 1
-                
-            save_data('invites.json', invites_data)
-            
-    except Exception as e:
-        print(f"Error tracking invite: {e}")
+    restore_rejoin(member)
+    # Find inviter (batched with other joins of the same guild). Rejoins stay in the batch so
+    # the invite use they consumed isn't credited to someone else.
+    invite_joins.add(member)
 
 @bot.event
 async def on_member_remove(member):
-    # Optional: Track leaves
-    pass
+    # Track leaves from the member -> inviter index (no API calls)
+    shard = get_shard(member.guild.id)
+    member_id = str(member.id)
+    record = shard.member_inviters.get(member_id)
+    if record is None or record["left"]:
+        return
+
+    record["left"] = True
+    # Fake joins were never counted as valid, so leaving doesn't cost the inviter anything
+    if not record["fake"]:
+        bump_invite_counter(member.guild.id, record["inviter_id"], "leaves")
+    shard.persist_member_inviter(member_id)
 
 
 # Run the bot
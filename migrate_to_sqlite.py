@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# One-shot migration of the JSON data (guild_data/<guild_id>/ folders and the older
+# global invites.json / giveaways.json) into the SQLite store.
+# After running it, set DATA_BACKEND=sqlite in .env and restart the bot.
+import sys
+
+from bot import SQLiteStore, SQLITE_PATH
+
+print("=" * 50)
+print("  Karys Shop Bot - JSON -> SQLite Migration")
+print("=" * 50)
+
+path = sys.argv[1] if len(sys.argv) > 1 else SQLITE_PATH
+store = SQLiteStore(path)
+
+if store.is_migrated():
+    print(f"ℹ️ {path} was already migrated, nothing to do.")
+else:
+    invites_count, giveaways_count = store.migrate_from_json('invites.json', 'giveaways.json')
+    print(f"✅ Imported {invites_count} invite records and {giveaways_count} giveaways into {path}")
+    print("Daba zid DATA_BACKEND=sqlite f .env o 3awd lanci l-bot.")
+
+store.close()